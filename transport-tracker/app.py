@@ -1,15 +1,82 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash
+import math
+import time
+import uuid
+from flask import (Flask, Response, before_render_template, flash, g, jsonify, redirect, render_template, request,
+                   session, template_rendered, url_for)
 from datetime import datetime
+from transport import metrics
 from transport.manager_fb_ds import TransportManagerFB
+from transport.profiling import SamplingProfiler, load_profiles, top_functions
 
 app = Flask(__name__)
 app.secret_key = "dev-secret"
 
 tm = TransportManagerFB()
+profiler = SamplingProfiler.from_env()   # off unless PROFILE_* is set (see transport/profiling.py)
+
+_REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "transport_http_request_duration_seconds",
+    "Time from request start until the response is ready (streams: until headers), by endpoint.",
+    ("endpoint", "method", "status"))
+_RENDER_SECONDS = metrics.REGISTRY.histogram("transport_template_render_seconds", "Jinja rendering time, by template.",
+                                             ("template",))
 
 @app.before_request
 def load_snapshot():
-    tm.refresh_from_db()
+    g.started = time.perf_counter()
+    # first request attaches the change listeners; later ones reuse the live snapshot
+    if request.endpoint != "static":
+        g.profile = profiler.start(forced=profiler.authorized(request.headers.get("X-Profile")))
+        tm.sync()
+
+@app.after_request
+def record_latency(response):
+    started = g.get("started")
+    if started is not None and request.endpoint != "static":
+        _REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or "unmatched", request.method,
+                                 response.status_code)
+    profile_id = profiler.stop(g.pop("profile", None), endpoint=request.endpoint, method=request.method,
+                               path=request.path, status=response.status_code)
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
+@app.teardown_request
+def stop_profile(exc):
+    # only still set if after_request never ran
+    profiler.stop(g.pop("profile", None), endpoint=request.endpoint, method=request.method, path=request.path,
+                  error=repr(exc) if exc else None)
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    if started is not None:
+        _RENDER_SECONDS.observe(time.perf_counter() - started, template.name)
+
+def _session_id() -> str:
+    """Stable per-browser id (kept in the signed session cookie) for per-user state."""
+    sid = session.get("sid")
+    if not sid:
+        sid = session["sid"] = uuid.uuid4().hex
+    return sid
+
+def _conditional(etag: str, build):
+    """
+    jsonify(build()) tagged with etag, or an empty 304 if the client already
+    holds that version (build() is then never called). no-cache makes browsers
+    revalidate every time instead of guessing a freshness lifetime.
+    """
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 @app.template_filter("datetime")
 def ts_to_dt(value):
@@ -27,17 +94,17 @@ def index():
             return redirect(url_for("route_view", route_id=route_id, stop_name=stop_name))
         flash("Please enter both Route ID and Stop name.")
     routes = tm.get_routes()
-    recent = tm.get_recent_searches()
+    recent = tm.get_recent_searches(_session_id())
     return render_template("index.html", routes=routes, recent=recent)
 
 @app.route("/route/<route_id>/stop/<stop_name>")
 def route_view(route_id, stop_name):
-    arrivals = tm.get_next_arrivals(route_id, stop_name, count=5)
+    arrivals = tm.get_next_arrivals(route_id, stop_name, count=5, session_id=_session_id())
     return render_template("route.html", route_id=route_id, stop_name=stop_name, arrivals=arrivals)
 
 @app.route("/stop/<stop_name>/earliest")
 def stop_view(stop_name):
-    ea = tm.get_earliest_arrival_at_stop(stop_name)
+    ea = tm.get_earliest_arrival_at_stop(stop_name, session_id=_session_id())
     if not ea:
         flash("No arrivals found for this stop.")
         return redirect(url_for("index"))
@@ -56,7 +123,7 @@ def api_arrivals():
     stop_name = request.args.get("stop_name")
     if not route_id or not stop_name:
         return jsonify({"ok": False, "error": "route_id and stop_name required"}), 400
-    data = tm.get_next_arrivals(route_id, stop_name, count=5)
+    data = tm.get_next_arrivals(route_id, stop_name, count=5, session_id=_session_id())
     return jsonify({"ok": True, "arrivals": data})
 
 @app.route("/api/next_arrival")
@@ -94,32 +161,85 @@ def api_depart():
     )
     return jsonify({"ok": ok})
 
+@app.route("/api/depart/batch", methods=["POST"])
+def api_depart_batch():
+    d = request.get_json(silent=True) or {}
+    items = d.get("departures")
+    if not isinstance(items, list):
+        return jsonify({"ok": False, "error": "departures list required"}), 400
+    if len(items) > 500:
+        return jsonify({"ok": False, "error": "at most 500 departures per batch"}), 400
+    results = tm.record_departures([x if isinstance(x, dict) else {} for x in items])
+    return jsonify({"ok": all(results), "results": results})
+
 @app.route("/api/stops")
 def api_stops():
     route_id = request.args.get("route_id")
     if not route_id:
         return jsonify({"ok": False, "error": "route_id required"}), 400
-    routes = tm.get_routes()
-    route = routes.get(route_id)
+    # tag before body: a change landing in between is then at worst served
+    # again, never cached under a tag that claims it is already included
+    etag = tm.stops_etag(route_id)
+    route = tm.get_routes().get(route_id)
     if not route:
         return jsonify({"ok": False, "error": "unknown route"}), 404
-    return jsonify({"ok": True, "stops": route.get("stops", [])})
+    return _conditional(etag, lambda: {"ok": True, "stops": route.get("stops", [])})
+
+@app.route("/api/routes")
+def api_routes():
+    return _conditional(tm.routes_etag(), lambda: {"ok": True, "routes": tm.get_routes()})
+
+@app.route("/api/stops/search")
+def api_stops_search():
+    q = request.args.get("q", "")
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    return jsonify({"ok": True, "items": tm.search_stops(q, limit=limit)})
+
+@app.route("/api/stops/nearby")
+def api_stops_nearby():
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+        radius = float(request.args.get("radius", 500))
+        k = min(max(int(request.args.get("k", 10)), 1), 50)
+    except (KeyError, ValueError):
+        return jsonify({"ok": False, "error": "lat and lng required (radius in metres, k optional)"}), 400
+    if not all(math.isfinite(x) for x in (lat, lng, radius)):
+        return jsonify({"ok": False, "error": "lat, lng and radius must be finite numbers"}), 400
+    radius = min(max(radius, 1.0), 20_000.0)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"ok": False, "error": "lat/lng out of range"}), 400
+    return jsonify({"ok": True, "items": tm.get_nearby_stops(lat, lng, radius_m=radius, k=k)})
+
+@app.route("/api/journey")
+def api_journey():
+    src = request.args.get("from", "").strip()
+    dst = request.args.get("to", "").strip()
+    if not src or not dst:
+        return jsonify({"ok": False, "error": "from and to required"}), 400
+    depart_after = request.args.get("depart_after", "").strip()
+    try:
+        if not depart_after:
+            when = None
+        elif ":" in depart_after:  # HH:MM today, server local time
+            hh, mm = (int(x) for x in depart_after.split(":", 1))
+            when = int(datetime.now().replace(hour=hh, minute=mm, second=0, microsecond=0).timestamp())
+        else:
+            when = int(depart_after)
+    except ValueError:
+        return jsonify({"ok": False, "error": "depart_after must be an epoch or HH:MM"}), 400
+    journey = tm.plan_journey(src, dst, depart_after=when)
+    return jsonify({"ok": True, "journey": journey})
 
 @app.route("/api/vehicle_status")
 def api_vehicle_status():
     route_id = request.args.get("route_id")
     if not route_id:
         return jsonify({"ok": False, "error": "route_id required"}), 400
-    vmap = tm.vehicles.get(route_id)
-    if not vmap:
-        return jsonify({"ok": True, "vehicles": {}})
-    out = {}
-    for vid, v in vmap.items():
-        out[vid] = {
-            "delayMinutes": int(v.get("delayMinutes", 0)),
-            "currentStopIndex": int(v.get("currentStopIndex", 0))
-        }
-    return jsonify({"ok": True, "vehicles": out})
+    return jsonify({"ok": True, "vehicles": tm.get_vehicle_status(route_id)})
 
 @app.route("/api/reports")
 def api_reports():
@@ -130,26 +250,89 @@ def api_reports():
     items = tm.get_recent_reports(route_id, limit=limit)
     return jsonify({"ok": True, "items": items})
 
+@app.route("/api/route_dashboard")
+def api_route_dashboard():
+    """Arrivals, vehicle status and recent reports of a route in one response, with ETag / 304."""
+    route_id = request.args.get("route_id")
+    stop_name = request.args.get("stop_name", "")
+    if not route_id:
+        return jsonify({"ok": False, "error": "route_id required"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 5)), 0), 100)
+    except ValueError:
+        limit = 5
+    etag = tm.route_dashboard_etag(route_id, stop_name)
+    if etag is None:
+        return jsonify({"ok": False, "error": "unknown route"}), 404
+    return _conditional(etag, lambda: {"ok": True, **(tm.get_route_dashboard(route_id, stop_name, reports=limit) or {})})
+
 @app.route("/api/recent_searches", methods=["GET", "POST"])
 def api_recent_searches():
     """
     GET  -> returns [{route_id, stop_name}, ...]
     POST -> clears the stack with body {"action": "clear"}
+    Both act on the caller's own session.
     """
     if request.method == "GET":
-        items = tm.get_recent_searches()
+        items = tm.get_recent_searches(_session_id())
         out = [{"route_id": r or "", "stop_name": s or ""} for (r, s) in items]
         return jsonify({"ok": True, "items": out})
 
     data = request.get_json(silent=True) or {}
     if str(data.get("action", "")).lower() == "clear":
-        tm.clear_recent_searches()
+        tm.clear_recent_searches(_session_id())
         return jsonify({"ok": True})
     return jsonify({"ok": False, "error": "unknown action"}), 400
 
+@app.route("/api/stream/route/<route_id>")
+def api_stream_route(route_id):
+    """
+    Server-Sent Events: one 'data:' message with {routeId, stopName, version,
+    arrivals, vehicles} whenever the route's snapshot changes (first one right
+    away), plus a comment line every 15 s to keep proxies from closing it.
+    """
+    sub = tm.subscribe_route(route_id, request.args.get("stop_name", ""))
+    if sub is None:
+        return jsonify({"ok": False, "error": "unknown route"}), 404
+
+    def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                payload = sub.get(timeout=15)
+                yield f"data: {payload}\n\n" if payload is not None else ": keepalive\n\n"
+        finally:
+            tm.unsubscribe_route(sub)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/api/health", methods=["GET"])
 def api_health():
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "snapshot": tm.snapshot_info()})
+
+@app.route("/api/profiles", methods=["GET"])
+def api_profiles():
+    # profiles name our code paths: only served to callers holding PROFILE_TOKEN
+    if not profiler.authorized(request.headers.get("X-Profile")):
+        return jsonify({"ok": False, "error": "not found"}), 404
+    endpoint = request.args.get("endpoint") or None
+    try:
+        last = min(max(int(request.args.get("last", 50)), 1), 1000)
+        limit = min(max(int(request.args.get("limit", 25)), 1), 200)
+    except ValueError:
+        last, limit = 50, 25
+    profiles = load_profiles(profiler.out_dir, endpoint, last)
+    return jsonify({
+        "ok": True,
+        "profiles": [{k: v for k, v in p.items() if k != "stacks"} for p in profiles],
+        "top": top_functions(profiles, limit),
+    })
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    tm.update_metrics()
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
     app.run(debug=True)
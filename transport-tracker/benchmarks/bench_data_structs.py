@@ -0,0 +1,410 @@
+"""
+Micro-benchmarks for transport/data_structs.py against their stdlib equivalents.
+
+    python benchmarks/bench_data_structs.py                 # run + compare to baseline
+    python benchmarks/bench_data_structs.py --quick         # sizes up to 10^4 only
+    python benchmarks/bench_data_structs.py --save-baseline # record a new baseline
+
+Each case times our structure and the stdlib one (collections.deque, heapq,
+list, dict) on the same seeded workload and reports ops/sec for both plus peak
+memory (tracemalloc) of the built structure. The baseline stores the ratios
+ours/stdlib rather than raw ops/sec, so it transfers between laptops; a case
+whose speed ratio drops (or memory ratio grows) by more than --tolerance fails
+the run with exit status 1. Ours and stdlib are timed in alternating rounds and
+every figure is the median over --repeat rounds, so one noisy sample (a
+scheduler hiccup, a frequency change) neither makes nor hides a regression.
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from transport.data_structs import Queue, Stack, MinHeap, HashMap
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = [10, 100, 1_000, 10_000, 100_000, 1_000_000]
+TARGET_OPS = 200_000  # repeat small sizes until each sample does roughly this many ops
+
+STOP_WORDS = ["fort", "slave island", "bambalapitiya", "wellawatte", "dehiwala", "mount lavinia",
+              "pettah", "kollupitiya", "havelock town", "nugegoda", "maradana", "dematagoda",
+              "kelaniya", "ragama", "gampaha", "veyangoda", "general hospital", "medical faculty"]
+
+
+# ---------- Workloads ----------
+def route_keys(n, rng):
+    """Route / vehicle ids shaped like B154, T01-03, E201-12."""
+    prefixes = "BTES"
+    return [f"{rng.choice(prefixes)}{i // 100:03d}-{i % 100:02d}" for i in range(n)]
+
+
+def stop_keys(n, rng):
+    """Normalized stop names (strip + lower), made unique with a suffix."""
+    return [f"{rng.choice(STOP_WORDS)} {i}" for i in range(n)]
+
+
+KEY_SHAPES = {"route_id": route_keys, "stop_name": stop_keys}
+
+
+def eta_items(n, rng):
+    """(eta_epoch, rid, vid) tuples as stored in the per-stop heaps."""
+    base = 1_700_000_000
+    return [(base + rng.randrange(86_400), f"B{i % 300}", f"B{i % 300}-{i % 7:02d}") for i in range(n)]
+
+
+# ---------- Cases: each returns (ours, stdlib) callables doing `ops` operations ----------
+def case_queue(n, rng):
+    items = list(range(n))
+
+    def ours():
+        q = Queue()
+        for x in items:
+            q.enqueue(x)
+        while not q.is_empty():
+            q.dequeue()
+        return q
+
+    def std():
+        q = deque()
+        for x in items:
+            q.append(x)
+        while q:
+            q.popleft()
+        return q
+
+    return ours, std, 2 * n
+
+
+def case_queue_bulk(n, rng):
+    items = list(range(n))
+
+    def ours():
+        q = Queue()
+        q.enqueue_many(items)
+        for _ in q:
+            pass
+        return q.drain()
+
+    def std():
+        q = deque()
+        q.extend(items)
+        for _ in q:
+            pass
+        return [q.popleft() for _ in range(len(q))]
+
+    return ours, std, 3 * n
+
+
+def case_stack_bounded(n, rng):
+    items = list(range(n))
+
+    def ours():
+        s = Stack(maxlen=20)
+        for x in items:
+            s.push(x)
+        return s
+
+    def std():
+        s = deque(maxlen=20)
+        for x in items:
+            s.append(x)
+        return s
+
+    return ours, std, n
+
+
+def case_stack(n, rng):
+    items = list(range(n))
+
+    def ours():
+        s = Stack()
+        for x in items:
+            s.push(x)
+        while not s.is_empty():
+            s.pop()
+        return s
+
+    def std():
+        s = []
+        for x in items:
+            s.append(x)
+        while s:
+            s.pop()
+        return s
+
+    return ours, std, 2 * n
+
+
+def case_heap(n, rng):
+    items = eta_items(n, rng)
+
+    def ours():
+        h = MinHeap()
+        for x in items:
+            h.insert(x)
+        while not h.is_empty():
+            h.extract_min()
+        return h
+
+    def std():
+        h = []
+        for x in items:
+            heapq.heappush(h, x)
+        while h:
+            heapq.heappop(h)
+        return h
+
+    return ours, std, 2 * n
+
+
+def make_hashmap_cases(shape):
+    make_keys = KEY_SHAPES[shape]
+
+    def case_put(n, rng):
+        keys = make_keys(n, rng)
+
+        def ours():
+            m = HashMap()
+            for k in keys:
+                m.put(k, k)
+            return m
+
+        def std():
+            m = {}
+            for k in keys:
+                m[k] = k
+            return m
+
+        return ours, std, n
+
+    def case_get(n, rng):
+        keys = make_keys(n, rng)
+        probe = keys[:]
+        rng.shuffle(probe)
+        ours_map = HashMap()
+        std_map = {}
+        for k in keys:
+            ours_map.put(k, k)
+            std_map[k] = k
+
+        def ours():
+            get = ours_map.get
+            for k in probe:
+                get(k)
+
+        def std():
+            get = std_map.get
+            for k in probe:
+                get(k)
+
+        return ours, std, n
+
+    def case_items(n, rng):
+        keys = make_keys(n, rng)
+        ours_map = HashMap()
+        std_map = {}
+        for k in keys:
+            ours_map.put(k, k)
+            std_map[k] = k
+
+        def ours():
+            for _k, _v in ours_map.items():
+                pass
+
+        def std():
+            for _k, _v in std_map.items():
+                pass
+
+        return ours, std, n
+
+    return {f"HashMap.put[{shape}]": case_put,
+            f"HashMap.get[{shape}]": case_get,
+            f"HashMap.items[{shape}]": case_items}
+
+
+CASES = {
+    "Queue.enqueue+dequeue": case_queue,
+    "Queue.enqueue_many+iter+drain": case_queue_bulk,
+    "Stack.push+pop": case_stack,
+    "Stack.push[maxlen=20]": case_stack_bounded,
+    "MinHeap.insert+extract": case_heap,
+}
+for _shape in KEY_SHAPES:
+    CASES.update(make_hashmap_cases(_shape))
+
+
+# ---------- Measurement ----------
+def _seconds_per_call(fn, loops):
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return (time.perf_counter() - t0) / loops
+
+
+def median_ops_per_sec(ours, std, ops, repeat):
+    """
+    (ours ops/s, stdlib ops/s, speed ratio), each the median over `repeat`
+    rounds. A round times ours then stdlib back to back and the ratio is
+    taken within the round, so drift between rounds cancels out.
+    """
+    loops = max(1, TARGET_OPS // max(ops, 1))
+    ours_t, std_t, ratios = [], [], []
+    for _ in range(max(1, repeat)):
+        t_ours, t_std = _seconds_per_call(ours, loops), _seconds_per_call(std, loops)
+        ours_t.append(t_ours)
+        std_t.append(t_std)
+        ratios.append(t_std / t_ours if t_ours > 0 else float("inf"))
+    ours_s, std_s = statistics.median(ours_t), statistics.median(std_t)
+    return (ops / ours_s if ours_s > 0 else float("inf"), ops / std_s if std_s > 0 else float("inf"),
+            statistics.median(ratios))
+
+
+def peak_bytes(build):
+    tracemalloc.start()
+    try:
+        kept = build()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return peak
+
+
+def run(sizes, repeat, only=None):
+    results = {}
+    for name, case in CASES.items():
+        if only and not any(o in name for o in only):
+            continue
+        for n in sizes:
+            rng = random.Random(1234 + n)
+            ours, std, ops = case(n, rng)
+            ours_ops, std_ops, ratio = median_ops_per_sec(ours, std, ops, repeat)
+            row = {"n": n, "ours_ops": ours_ops, "std_ops": std_ops, "speed_ratio": ratio}
+            builder = _builder(name, n)
+            if builder:
+                ours_mem, std_mem = peak_bytes(builder[0]), peak_bytes(builder[1])
+                row.update(ours_peak=ours_mem, std_peak=std_mem,
+                           mem_ratio=ours_mem / std_mem if std_mem else 1.0)
+            results[f"{name}@{n}"] = row
+            _print_row(name, row)
+    return results
+
+
+def _builder(name, n):
+    """Populate (without draining) ours and the stdlib structure, for peak-memory runs."""
+    rng = random.Random(99 + n)
+    if name.startswith("HashMap.put"):
+        keys = KEY_SHAPES[name[name.index("[") + 1:-1]](n, rng)
+        return (lambda: _fill(HashMap(), keys, lambda m, k: m.put(k, k)),
+                lambda: _fill({}, keys, lambda m, k: m.__setitem__(k, k)))
+    if name.startswith("Queue.enqueue_many"):
+        items = list(range(n))
+        return (lambda: _fill(Queue(), [items], Queue.enqueue_many), lambda: _fill(deque(), [items], deque.extend))
+    if name.startswith("Queue"):
+        items = list(range(n))
+        return (lambda: _fill(Queue(), items, Queue.enqueue), lambda: _fill(deque(), items, deque.append))
+    if name.startswith("Stack.push["):
+        items = list(range(n))
+        return (lambda: _fill(Stack(maxlen=20), items, Stack.push),
+                lambda: _fill(deque(maxlen=20), items, deque.append))
+    if name.startswith("Stack"):
+        items = list(range(n))
+        return (lambda: _fill(Stack(), items, Stack.push), lambda: _fill([], items, list.append))
+    if name.startswith("MinHeap"):
+        items = eta_items(n, rng)
+        return (lambda: _fill(MinHeap(), items, MinHeap.insert), lambda: _fill([], items, heapq.heappush))
+    return None
+
+
+def _fill(container, items, add):
+    for x in items:
+        add(container, x)
+    return container
+
+
+def _print_row(name, row):
+    mem = ""
+    if "mem_ratio" in row:
+        mem = f"  peak {row['ours_peak'] / 1024:10.1f} KiB vs {row['std_peak'] / 1024:10.1f} KiB"
+    print(f"{name:32s} n={row['n']:>8d}  ours {row['ours_ops']:>13,.0f} ops/s  "
+          f"stdlib {row['std_ops']:>13,.0f} ops/s  x{row['speed_ratio']:.3f}{mem}")
+
+
+def compare(results, baseline, tolerance, min_bytes=4096):
+    """
+    Return a list of human-readable regressions against the saved baseline.
+    A memory ratio only counts when ours also peaks at least min_bytes above
+    what the baseline ratio allows: at small n a few hundred bytes of
+    allocator noise move the ratio by far more than the tolerance.
+    """
+    failures = []
+    for key, row in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if row["speed_ratio"] < base["speed_ratio"] * (1 - tolerance):
+            failures.append(f"{key}: speed ratio {row['speed_ratio']:.3f} < baseline {base['speed_ratio']:.3f}")
+        if "mem_ratio" in row and "mem_ratio" in base:
+            excess = row["ours_peak"] - base["mem_ratio"] * row["std_peak"]
+            if row["mem_ratio"] > base["mem_ratio"] * (1 + tolerance) and excess >= min_bytes:
+                failures.append(f"{key}: memory ratio {row['mem_ratio']:.3f} > baseline {base['mem_ratio']:.3f}")
+    return failures
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    ap.add_argument("--quick", action="store_true", help="only sizes up to 10^4")
+    ap.add_argument("--repeat", type=int, default=7, help="rounds per case; the median is kept")
+    ap.add_argument("--only", nargs="+", help="run cases whose name contains any of these")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.30)
+    ap.add_argument("--min-bytes", type=int, default=4096,
+                    help="ignore memory ratio growth smaller than this many bytes of peak")
+    ap.add_argument("--json", help="also write raw results to this file")
+    args = ap.parse_args(argv)
+
+    sizes = [n for n in args.sizes if n <= 10_000] if args.quick else args.sizes
+    results = run(sizes, args.repeat, args.only)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        for key, row in results.items():
+            baseline[key] = {k: round(v, 4) for k, v in row.items() if k in ("speed_ratio", "mem_ratio")}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"saved baseline for {len(results)} cases to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline found; run with --save-baseline to create one")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    failures = compare(results, baseline, args.tolerance, args.min_bytes)
+    for line in failures:
+        print("REGRESSION", line)
+    print(f"{len(failures)} regression(s) against {args.baseline}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
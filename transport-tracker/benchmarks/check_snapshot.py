@@ -0,0 +1,215 @@
+"""
+Consistency checks for the live snapshot in transport/manager_fb_ds.py.
+
+    python benchmarks/check_snapshot.py                  # default mix of writes
+    python benchmarks/check_snapshot.py --writes 500 --taps 16 --seed 3
+
+Runs against the in-memory RTDB (rtdb_memory.py) filled by seed_firebase, never
+a real database. Two checks, each failing the run with exit status 1:
+
+  incremental  a manager kept up to date by its change listeners (reports,
+               departures, delay / schedule edits, vehicles and routes added
+               and removed, stop moves) must answer every query exactly like a
+               fresh manager rebuilt from the same tree with refresh_from_db.
+  departures   --taps concurrent record_departure calls on one vehicle must
+               advance its currentStopIndex by exactly --taps, in the database
+               and in the snapshot.
+
+Other RTDB_* knobs (latency, jitter) pass through, which widens the races;
+error injection is switched off since a failed write is not a mismatch.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+os.environ["RTDB_BACKEND"] = "memory"
+for name in ("RTDB_MEMORY_FILE", "RTDB_MEMORY_AUTOSAVE", "RTDB_ERROR_RATE", "SNAPSHOT_FILE", "SNAPSHOT_SHM"):
+    os.environ.pop(name, None)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from firebase_init import init_firebase, rtdb_ref
+from transport import seed_firebase
+from transport.manager_fb_ds import TransportManagerFB
+
+SETTLE_S = 5.0  # how long the listeners get to catch up before a difference counts
+
+
+# ---------- Setup ----------
+def seed():
+    """The seed_firebase data set, written quietly into the in-memory tree."""
+    init_firebase()
+    rtdb_ref("/routes").set(seed_firebase.build_routes())
+    rtdb_ref("/stopsGeo").set(seed_firebase.build_stops_geo())
+    rtdb_ref("/vehicles").set(seed_firebase.build_vehicles(datetime.now(seed_firebase.LKT)))
+    rtdb_ref("/reports").set(seed_firebase.add_realistic_incidents())
+
+
+def vehicles():
+    return rtdb_ref("/vehicles").get() or {}
+
+
+# ---------- Queries ----------
+def answers(tm, depart_after):
+    """Every read the API serves, keyed by the call that produced it."""
+    out = {("routes",): tm.get_routes()}
+    stops = set()
+    for rid, route in tm.get_routes().items():
+        out[("status", rid)] = tm.get_vehicle_status(rid)
+        route_stops = route.get("stops") or []
+        stops.update(route_stops)
+        for stop in route_stops:
+            out[("next", rid, stop)] = tm.get_next_arrivals(rid, stop, 5)
+            out[("first", rid, stop)] = tm.get_next_arrival_epoch(rid, stop)
+        if len(route_stops) > 1:
+            key = ("journey", route_stops[0], route_stops[-1])
+            out[key] = tm.plan_journey(route_stops[0], route_stops[-1], depart_after=depart_after)
+    for stop in sorted(stops):
+        out[("earliest", stop)] = tm.get_earliest_arrival_at_stop(stop)
+        geo = tm.get_stop_geo(stop)
+        out[("geo", stop)] = geo
+        if geo:
+            out[("nearby", stop)] = tm.get_nearby_stops(geo["lat"], geo["lng"], radius_m=2000)
+    for prefix in ("", "a", "fo", "m", "ko"):
+        out[("search", prefix)] = tm.search_stops(prefix, limit=20)
+    return out
+
+
+def differences(a, b):
+    return sorted((k for k in a.keys() | b.keys() if a.get(k) != b.get(k)), key=repr)
+
+
+# ---------- Writes ----------
+def random_writes(tm, n, rng):
+    """n writes, half through the manager and half straight into the tree."""
+    added = 0
+    for i in range(n):
+        tree = vehicles()
+        rid = rng.choice(sorted(tree))
+        vid = rng.choice(sorted(tree[rid])) if tree[rid] else None
+        v = tree[rid].get(vid) or {}
+        kind = i % 9
+        if kind == 0 and vid:
+            tm.submit_report(rid, vid, "delay", rng.randrange(1, 6), "check")
+        elif kind == 1:
+            tm.submit_report(rid, None, "delay", rng.randrange(1, 4), "check, route-wide")
+        elif kind == 2 and vid:
+            sched = v.get("schedule") or []
+            idx = int(v.get("currentStopIndex", 0))
+            if idx < len(sched):
+                tm.record_departure(rid, vid, sched[idx]["stop"])
+        elif kind == 3 and vid:
+            rtdb_ref(f"/vehicles/{rid}/{vid}/delayMinutes").set(rng.randrange(30))
+        elif kind == 4 and vid:
+            shift = rng.choice((-300, 120, 600))
+            sched = [dict(e, timeEpoch=int(e["timeEpoch"]) + shift) for e in v.get("schedule") or []]
+            rtdb_ref(f"/vehicles/{rid}/{vid}/schedule").set(sched)
+        elif kind == 5 and vid:
+            added += 1
+            rtdb_ref(f"/vehicles/{rid}/{vid}-x{added}").set(dict(v, delayMinutes=rng.randrange(10)))
+        elif kind == 6 and vid and len(tree[rid]) > 1:
+            rtdb_ref(f"/vehicles/{rid}/{vid}").delete()
+        elif kind == 7:
+            stop = rng.choice(sorted(rtdb_ref("/stopsGeo").get(shallow=True) or {}))
+            geo = rtdb_ref(f"/stopsGeo/{stop}").get() or {}
+            rtdb_ref(f"/stopsGeo/{stop}").update({"lat": float(geo.get("lat", 0)) + 0.001})
+        elif kind == 8 and vid:
+            new = f"{rid}-check{i}"
+            route = rtdb_ref(f"/routes/{rid}").get() or {}
+            rtdb_ref(f"/routes/{new}").set(dict(route, routeName=f"{route.get('routeName', rid)} (check)"))
+            rtdb_ref(f"/vehicles/{new}").set({f"{new}-01": v})
+
+
+# ---------- Checks ----------
+def check_incremental(n, rng) -> bool:
+    live = TransportManagerFB()
+    live.sync()
+    try:
+        if live.snapshot_info().get("source") != "listeners":
+            print(f"incremental: SKIP, listeners did not start ({live.snapshot_info()})")
+            return True
+        random_writes(live, n, rng)
+        depart_after = int(time.time())
+        deadline = time.monotonic() + SETTLE_S
+        while True:
+            fresh = TransportManagerFB()
+            fresh.refresh_from_db()
+            got, want = answers(live, depart_after), answers(fresh, depart_after)
+            diff = differences(got, want)
+            if not diff or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        if diff:
+            print(f"incremental: FAIL, {len(diff)} queries differ after {n} writes, e.g.")
+            for key in diff[:5]:
+                print(f"  {key}:\n    live  {got.get(key)!r}\n    fresh {want.get(key)!r}")
+            return False
+        print(f"incremental: ok, {n} writes, live snapshot matches a rebuild ({live.snapshot_info()['version']} versions)")
+        return True
+    finally:
+        live.close()
+
+
+def check_departures(taps, rng) -> bool:
+    tm = TransportManagerFB()
+    tm.sync()
+    try:
+        tree = vehicles()
+        candidates = [(rid, vid) for rid in sorted(tree) for vid, v in sorted(tree[rid].items())
+                      if int(v.get("currentStopIndex", 0)) + taps < len(v.get("schedule") or [])]
+        if not candidates:
+            print(f"departures: SKIP, no vehicle has {taps} stops left")
+            return True
+        rid, vid = rng.choice(candidates)
+        start = int(tree[rid][vid].get("currentStopIndex", 0))
+        stop = "(not on any schedule)"   # a named stop may skip ahead by two; this one always moves one
+        gate = threading.Barrier(taps)
+        results = [None] * taps
+
+        def tap(i):
+            gate.wait()
+            results[i] = tm.record_departure(rid, vid, stop)
+
+        threads = [threading.Thread(target=tap, args=(i,)) for i in range(taps)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stored = int(rtdb_ref(f"/vehicles/{rid}/{vid}/currentStopIndex").get() or 0)
+        deadline = time.monotonic() + SETTLE_S
+        while True:
+            local = (tm.get_vehicle_status(rid).get(vid) or {}).get("currentStopIndex")
+            if local == stored or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        ok = all(results) and stored == start + taps and local == stored
+        print(f"departures: {'ok' if ok else 'FAIL'}, {taps} concurrent taps on {rid}/{vid}: "
+              f"index {start} -> {stored} in the database, {local} in the snapshot, "
+              f"{results.count(True)} reported ok")
+        return ok
+    finally:
+        tm.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writes", type=int, default=200, help="writes before comparing (default 200)")
+    parser.add_argument("--taps", type=int, default=8, help="concurrent departures (default 8)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    seed()
+    rng = random.Random(args.seed)
+    ok = check_incremental(args.writes, rng)
+    ok = check_departures(args.taps, rng) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,28 @@
+import functools
+import json
 import os
-import firebase_admin
-from firebase_admin import credentials, db
+import time
+from transport.metrics import REGISTRY
 
 _app = None
+_memdb = None
+
+def _use_memory() -> bool:
+    return os.getenv("RTDB_BACKEND", "firebase").strip().lower() == "memory"
 
 def init_firebase():
-    global _app
+    global _app, _memdb
     if _app is not None:
         return _app
 
+    if _use_memory():
+        from rtdb_memory import MemoryDatabase
+        _memdb = _app = MemoryDatabase.from_env()
+        return _app
+
+    import firebase_admin
+    from firebase_admin import credentials
+
     sa_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "serviceAccountKey.json")
     db_url = os.getenv("FIREBASE_DB_URL")
 
@@ -22,4 +36,74 @@ def init_firebase():
 def rtdb_ref(path: str):
     if not path.startswith("/"):
         path = "/" + path
-    return db.reference(path)
+    if _memdb is not None:
+        return _Accounted(_memdb.reference(path))
+    from firebase_admin import db
+    return _Accounted(db.reference(path))
+
+# ---------- Call accounting (exported at /api/metrics) ----------
+_CALL_SECONDS = REGISTRY.histogram("transport_rtdb_call_duration_seconds",
+                                   "Wall time of database calls, by operation.", ("op",))
+_CALL_ERRORS = REGISTRY.counter("transport_rtdb_call_errors_total", "Database calls that raised, by operation.", ("op",))
+_CALL_BYTES = REGISTRY.counter("transport_rtdb_payload_bytes_total",
+                               "JSON size of values read (down) and written (up), by operation.", ("op", "direction"))
+
+# calls that go to the database; everything else on a reference / query is local
+_OPS = {"get", "set", "update", "push", "delete", "transaction", "set_if_unchanged", "listen"}
+# calls that return another reference / query, whose calls are then accounted too
+_CHAINED = {"child", "push", "order_by_child", "order_by_key", "order_by_value",
+            "limit_to_first", "limit_to_last", "start_at", "end_at", "equal_to"}
+
+def _size(value) -> int:
+    """Bytes value takes as compact JSON: a backend-independent stand-in for the wire size."""
+    if value is None:
+        return 0
+    try:
+        return len(json.dumps(value, separators=(",", ":"), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+class _Accounted:
+    """
+    Wraps a Reference / Query so every call that reaches the database is
+    timed, counted and sized, for either backend. Listener callbacks are
+    wrapped too, so pushed events count as bytes down.
+    """
+    __slots__ = ("_target",)
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in _OPS and name not in _CHAINED:
+            return attr
+        return functools.partial(self._call, name, attr)
+
+    def _call(self, op: str, fn, *args, **kwargs):
+        if op == "listen" and args:
+            callback = args[0]
+            def counted(event):
+                _CALL_BYTES.inc("event", "down", amount=_size(event.data))
+                callback(event)
+            args = (counted,) + args[1:]
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            _CALL_ERRORS.inc(op)
+            raise
+        finally:
+            if op in _OPS:
+                _CALL_SECONDS.observe(time.perf_counter() - started, op)
+        if op == "get":
+            _CALL_BYTES.inc(op, "down", amount=_size(result[0] if kwargs.get("etag") else result))
+        elif op == "transaction":
+            _CALL_BYTES.inc(op, "up", amount=_size(result))   # what was committed; retries are not visible here
+        elif op in ("set", "update", "set_if_unchanged") or (op == "push" and args):
+            _CALL_BYTES.inc(op, "up", amount=_size(args[-1]))
+        return _Accounted(result) if op in _CHAINED else result
+
+def rtdb_stats():
+    """Call / byte counters of the in-memory backend (None when talking to Firebase)."""
+    return _memdb.stats() if _memdb is not None else None
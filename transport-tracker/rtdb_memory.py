@@ -0,0 +1,497 @@
+"""
+In-process stand-in for the Firebase Realtime Database.
+
+Selected with RTDB_BACKEND=memory; firebase_init.rtdb_ref() then hands out
+MemoryReference objects with the same get/set/update/push/child/listen/
+transaction/order_by_child surface the app uses, backed by a local JSON tree.
+Server values ({".sv": "timestamp"}, {".sv": {"increment": n}}) resolve on write.
+
+Environment knobs (all optional):
+  RTDB_MEMORY_FILE      JSON file to load the tree from (and save to)
+  RTDB_MEMORY_AUTOSAVE  "1" to write the file back after every mutation
+  RTDB_LATENCY_MS       fixed delay added to every call
+  RTDB_JITTER_MS        extra uniform random delay per call
+  RTDB_BANDWIDTH_KBPS   simulated link speed; payload bytes add transfer time
+  RTDB_ERROR_RATE       probability (0..1) that a call raises InjectedFailure
+  RTDB_SEED             seed for jitter / error injection
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+class InjectedFailure(RuntimeError):
+    """Raised by MemoryDatabase when error injection fires."""
+
+
+def _split(path: str) -> List[str]:
+    return [p for p in (path or "/").split("/") if p]
+
+
+def _join(parts: List[str]) -> str:
+    return "/" + "/".join(parts)
+
+
+def _child(node, key):
+    if isinstance(node, dict):
+        return node.get(key)
+    if isinstance(node, list) and key.isdigit() and int(key) < len(node):
+        return node[int(key)]
+    return None
+
+
+class MemoryEvent:
+    """Mirrors firebase_admin.db.Event."""
+
+    def __init__(self, event_type: str, path: str, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class MemoryListener:
+    """Delivers events to one callback on its own thread, like ListenerRegistration."""
+
+    def __init__(self, db: "MemoryDatabase", parts: List[str], callback: Callable):
+        self._db = db
+        self.parts = parts
+        self._callback = callback
+        self._events = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def deliver(self, event: MemoryEvent):
+        self._db._account_event(len(_dumps(event.data)))
+        self._events.put(event)
+
+    def _run(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            try:
+                self._callback(event)
+            except Exception:
+                pass
+
+    def close(self):
+        self._db._remove_listener(self)
+        self._events.put(None)
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class MemoryDatabase:
+    def __init__(self, data: Optional[dict] = None, file_path: Optional[str] = None,
+                 autosave: bool = False, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 bandwidth_kbps: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self._root = data if data is not None else {}
+        self.file_path = file_path
+        self.autosave = autosave
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bandwidth_kbps = bandwidth_kbps
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._listeners: List[MemoryListener] = []
+        self._last_push_ms = 0
+        self._last_push_rand: List[int] = []
+        self.reset_stats()
+        if file_path and data is None and os.path.exists(file_path):
+            with open(file_path, encoding="utf-8") as f:
+                self._root = json.load(f) or {}
+
+    @classmethod
+    def from_env(cls) -> "MemoryDatabase":
+        seed = os.getenv("RTDB_SEED")
+        return cls(
+            file_path=os.getenv("RTDB_MEMORY_FILE") or None,
+            autosave=os.getenv("RTDB_MEMORY_AUTOSAVE", "") == "1",
+            latency_ms=float(os.getenv("RTDB_LATENCY_MS", 0) or 0),
+            jitter_ms=float(os.getenv("RTDB_JITTER_MS", 0) or 0),
+            bandwidth_kbps=float(os.getenv("RTDB_BANDWIDTH_KBPS", 0) or 0),
+            error_rate=float(os.getenv("RTDB_ERROR_RATE", 0) or 0),
+            seed=int(seed) if seed else None,
+        )
+
+    def reference(self, path: str = "/") -> "MemoryReference":
+        return MemoryReference(self, _split(path))
+
+    # ---------- Accounting ----------
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {"calls": {}, "bytesDown": 0, "bytesUp": 0, "errors": 0, "simulatedSeconds": 0.0}
+
+    def stats(self) -> Dict:
+        """Counters of calls per operation and bytes moved in each direction."""
+        with self._lock:
+            out = dict(self._stats)
+            out["calls"] = dict(self._stats["calls"])
+            out["totalCalls"] = sum(out["calls"].values())
+        return out
+
+    def _account(self, op: str, down: int = 0, up: int = 0):
+        """Record one call, then apply injected latency / bandwidth / failures."""
+        delay = self.latency_ms / 1000.0
+        if self.jitter_ms:
+            delay += self._rng.uniform(0, self.jitter_ms) / 1000.0
+        if self.bandwidth_kbps:
+            delay += (down + up) / (self.bandwidth_kbps * 1024.0)
+        fail = self.error_rate and self._rng.random() < self.error_rate
+        with self._lock:
+            calls = self._stats["calls"]
+            calls[op] = calls.get(op, 0) + 1
+            self._stats["bytesDown"] += down
+            self._stats["bytesUp"] += up
+            self._stats["simulatedSeconds"] += delay
+            if fail:
+                self._stats["errors"] += 1
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise InjectedFailure(f"injected failure on {op}")
+
+    def _account_event(self, down: int):
+        """Listener pushes are egress too, but cost no request round trip."""
+        with self._lock:
+            calls = self._stats["calls"]
+            calls["event"] = calls.get("event", 0) + 1
+            self._stats["bytesDown"] += down
+
+    # ---------- Tree access ----------
+    def _read(self, parts: List[str]):
+        node = self._root
+        for key in parts:
+            node = _child(node, key)
+            if node is None:
+                return None
+        return node
+
+    def _write(self, parts: List[str], value):
+        """Set value at parts (None deletes) and prune empty parents, like RTDB."""
+        if not parts:
+            self._root = value if isinstance(value, dict) else {}
+            return
+        trail = []
+        node = self._root
+        for key in parts[:-1]:
+            nxt = _child(node, key)
+            if not isinstance(nxt, (dict, list)):
+                if value is None:
+                    return
+                nxt = {}
+                if isinstance(node, list):
+                    while len(node) <= int(key):
+                        node.append(None)
+                    node[int(key)] = nxt
+                else:
+                    node[key] = nxt
+            trail.append((node, key))
+            node = nxt
+        last = parts[-1]
+        if isinstance(node, list) and last.isdigit():
+            idx = int(last)
+            while len(node) <= idx:
+                node.append(None)
+            node[idx] = value
+        elif isinstance(node, list):
+            return
+        elif value is None:
+            node.pop(last, None)
+        else:
+            node[last] = value
+        while trail and not node:
+            parent, key = trail.pop()
+            if isinstance(parent, list):
+                parent[int(key)] = None
+            else:
+                parent.pop(key, None)
+            node = parent
+
+    def _server_values(self, parts: List[str], value):
+        """value with server values ({".sv": "timestamp"} / {".sv": {"increment": n}}) resolved at parts."""
+        if not isinstance(value, dict):
+            return value
+        sv = value.get(".sv")
+        if sv == "timestamp":
+            return int(time.time() * 1000)
+        if isinstance(sv, dict) and "increment" in sv:
+            cur = self._read(parts)
+            return (cur if isinstance(cur, (int, float)) and not isinstance(cur, bool) else 0) + sv["increment"]
+        return {k: self._server_values(parts + [k], v) for k, v in value.items()}
+
+    def _commit(self, writes: List[tuple]):
+        """Apply [(parts, value)] and queue listener events under the lock, then persist."""
+        with self._lock:
+            writes = [(parts, self._server_values(parts, value)) for parts, value in writes]
+            for parts, value in writes:
+                self._write(parts, value)
+            # queued before the lock is released, so listeners see commits in commit order
+            for listener, event in self._events_for(writes):
+                listener.deliver(event)
+            if self.autosave and self.file_path:
+                self.save()
+
+    def _events_for(self, writes: List[tuple]):
+        events = []
+        for listener in self._listeners:
+            lp = listener.parts
+            below = {}
+            whole = False
+            for parts, value in writes:
+                if parts[:len(lp)] == lp:
+                    rel = parts[len(lp):]
+                    below[_join(rel)] = value
+                    whole = whole or not rel
+                elif lp[:len(parts)] == parts:
+                    whole = True
+            if whole:
+                events.append((listener, MemoryEvent("put", "/", _copy(self._read(lp)))))
+            elif len(below) == 1:
+                path, value = next(iter(below.items()))
+                events.append((listener, MemoryEvent("put", path, _copy(value))))
+            elif below:
+                events.append((listener, MemoryEvent("patch", "/", _copy(below))))
+        return events
+
+    def _remove_listener(self, listener: MemoryListener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def save(self, file_path: Optional[str] = None):
+        """Write the tree to file_path (or the configured file) atomically."""
+        target = file_path or self.file_path
+        if not target:
+            raise ValueError("no file path configured for MemoryDatabase")
+        with self._lock:
+            tmp = target + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._root, f, separators=(",", ":"))
+            os.replace(tmp, target)
+
+    def _push_key(self) -> str:
+        """Chronologically ordered 20-char key in the style of RTDB push IDs."""
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now == self._last_push_ms and self._last_push_rand:
+                rand = self._last_push_rand
+                i = 11
+                while i >= 0 and rand[i] == 63:
+                    rand[i] = 0
+                    i -= 1
+                if i >= 0:
+                    rand[i] += 1
+            else:
+                rand = [self._rng.randrange(64) for _ in range(12)]
+            self._last_push_ms, self._last_push_rand = now, rand
+        head = []
+        for _ in range(8):
+            head.append(PUSH_CHARS[now % 64])
+            now //= 64
+        return "".join(reversed(head)) + "".join(PUSH_CHARS[c] for c in rand)
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _copy(value):
+    return None if value is None else json.loads(_dumps(value))
+
+
+def _etag(payload: str) -> str:
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryReference:
+    def __init__(self, db: MemoryDatabase, parts: List[str]):
+        self._db = db
+        self._parts = parts
+
+    @property
+    def key(self) -> Optional[str]:
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self) -> str:
+        return _join(self._parts)
+
+    @property
+    def parent(self) -> Optional["MemoryReference"]:
+        return MemoryReference(self._db, self._parts[:-1]) if self._parts else None
+
+    def child(self, path: str) -> "MemoryReference":
+        return MemoryReference(self._db, self._parts + _split(path))
+
+    def get(self, etag: bool = False, shallow: bool = False):
+        if etag and shallow:
+            raise ValueError("etag and shallow cannot both be set to True.")
+        with self._db._lock:
+            value = self._db._read(self._parts)
+            if shallow and isinstance(value, dict):
+                value = {k: True for k in value}
+            elif shallow and isinstance(value, list):
+                value = {str(i): True for i, v in enumerate(value) if v is not None}
+            payload = _dumps(value)
+        self._db._account("get", down=len(payload))
+        value = json.loads(payload)
+        return (value, _etag(payload)) if etag else value
+
+    def set(self, value):
+        if value is None:
+            raise ValueError("Value must not be None.")
+        payload = _dumps(value)
+        self._db._account("set", up=len(payload))
+        self._db._commit([(self._parts, json.loads(payload))])
+
+    def update(self, value: dict):
+        if not value or not isinstance(value, dict):
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        payload = _dumps(value)
+        self._db._account("update", up=len(payload))
+        data = json.loads(payload)
+        self._db._commit([(self._parts + _split(k), v) for k, v in data.items()])
+
+    def push(self, value=""):
+        if value is None:
+            raise ValueError("Value must not be None.")
+        payload = _dumps(value)
+        self._db._account("push", up=len(payload))
+        ref = self.child(self._db._push_key())
+        self._db._commit([(ref._parts, json.loads(payload))])
+        return ref
+
+    def delete(self):
+        self._db._account("delete")
+        self._db._commit([(self._parts, None)])
+
+    def set_if_unchanged(self, expected_etag: str, value):
+        """Compare-and-set on the etag of the current value; returns (ok, value, etag)."""
+        payload = _dumps(value)
+        with self._db._lock:
+            current = _dumps(self._db._read(self._parts))
+            ok = _etag(current) == expected_etag
+            if ok:
+                self._db._write(self._parts, json.loads(payload))
+                for listener, event in self._db._events_for([(self._parts, value)]):
+                    listener.deliver(event)   # under the lock: events keep commit order
+                if self._db.autosave and self._db.file_path:
+                    self._db.save()
+        self._db._account("set_if_unchanged", down=0 if ok else len(current), up=len(payload))
+        if not ok:
+            return False, json.loads(current), _etag(current)
+        return True, json.loads(payload), _etag(payload)
+
+    def transaction(self, transaction_update: Callable):
+        if not callable(transaction_update):
+            raise ValueError("transaction_update must be a function.")
+        data, etag = self.get(etag=True)
+        for _ in range(25):
+            new_data = transaction_update(data)
+            ok, data, etag = self.set_if_unchanged(etag, new_data)
+            if ok:
+                return new_data
+        raise RuntimeError("Transaction aborted after failed retries.")
+
+    def listen(self, callback: Callable) -> MemoryListener:
+        self._db._account("listen")
+        with self._db._lock:
+            listener = MemoryListener(self._db, self._parts, callback)
+            self._db._listeners.append(listener)
+            listener.deliver(MemoryEvent("put", "/", _copy(self._db._read(self._parts))))
+        return listener
+
+    def order_by_child(self, path: str) -> "MemoryQuery":
+        return MemoryQuery(self, lambda k, v: _child_value(v, _split(path)))
+
+    def order_by_key(self) -> "MemoryQuery":
+        return MemoryQuery(self, lambda k, v: k)
+
+    def order_by_value(self) -> "MemoryQuery":
+        return MemoryQuery(self, lambda k, v: v)
+
+
+def _child_value(value, parts: List[str]):
+    for key in parts:
+        value = _child(value, key)
+    return value
+
+
+def _sort_key(v):
+    # RTDB ordering: null < false < true < numbers < strings < objects
+    if v is None:
+        return (0, 0)
+    if v is False:
+        return (1, 0)
+    if v is True:
+        return (2, 0)
+    if isinstance(v, (int, float)):
+        return (3, v)
+    if isinstance(v, str):
+        return (4, v)
+    return (5, 0)
+
+
+class MemoryQuery:
+    """Ordered / limited query with the firebase_admin.db.Query builder surface."""
+
+    def __init__(self, ref: MemoryReference, order: Callable):
+        self._ref = ref
+        self._order = order
+        self._first = None
+        self._last = None
+        self._start = None
+        self._end = None
+
+    def limit_to_first(self, limit: int) -> "MemoryQuery":
+        self._first = int(limit)
+        return self
+
+    def limit_to_last(self, limit: int) -> "MemoryQuery":
+        self._last = int(limit)
+        return self
+
+    def start_at(self, start) -> "MemoryQuery":
+        self._start = start
+        return self
+
+    def end_at(self, end) -> "MemoryQuery":
+        self._end = end
+        return self
+
+    def equal_to(self, value) -> "MemoryQuery":
+        self._start = self._end = value
+        return self
+
+    def get(self):
+        db = self._ref._db
+        with db._lock:
+            node = db._read(self._ref._parts)
+            if isinstance(node, list):
+                node = {str(i): v for i, v in enumerate(node) if v is not None}
+            entries = []
+            for k, v in (node or {}).items():
+                sk = _sort_key(self._order(k, v))
+                if self._start is not None and sk < _sort_key(self._start):
+                    continue
+                if self._end is not None and sk > _sort_key(self._end):
+                    continue
+                entries.append((sk, k, v))
+            entries.sort(key=lambda e: (e[0], e[1]))
+            if self._first is not None:
+                entries = entries[:self._first]
+            if self._last is not None:
+                entries = entries[-self._last:] if self._last else []
+            payload = _dumps({k: v for _, k, v in entries})
+        db._account("query", down=len(payload))
+        data = json.loads(payload)
+        return {k: data[k] for _, k, _ in entries}
@@ -0,0 +1,208 @@
+from itertools import chain
+from typing import Dict, Hashable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: without numpy the manager keeps the per-row indexes
+    np = None
+
+HAVE_NUMPY = np is not None
+
+
+class ScheduleColumns:
+    """
+    Columnar schedule store: every schedule row of every vehicle lives in
+    parallel arrays (vehicle slot, stop id, scheduled epoch, stop position),
+    grouped by stop id and, within a stop, by route. Delay and current stop
+    index are per-vehicle columns, so ETAs and "still ahead" masks are computed
+    vectorized at query time and a delay / departure update is an O(1) write
+    instead of a rebuild.
+
+    Routes and stops are the manager's interned integer ids (dense, so a stop
+    id indexes the per-stop row bounds directly); vehicle ids stay as given.
+    Rows are registered per vehicle with set_vehicle(); a vehicle whose
+    schedule changed only marks the row columns dirty and they are re-laid out
+    (one concatenate + stable sort) on the next query.
+
+    Pickled, it is just its arrays (large ones out of band, see persist): the
+    per-vehicle row lists are rebuilt from the row columns only if an
+    unpickled copy is modified, so one that is only read can keep its row
+    columns as read-only views of a shared buffer.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("ScheduleColumns needs numpy")
+        self._n_stops = 0                          # 1 + largest stop id seen
+        self._slots: Dict[Tuple, int] = {}         # (route id, vid) -> vehicle slot
+        self._vids: List[Optional[Hashable]] = []  # slot -> vid
+        self._free: List[int] = []
+        self._blocks: Optional[Dict[int, tuple]] = {}  # slot -> (stop ids, epochs, positions); None: see _block_map
+        self.v_route = np.full(8, -1, dtype=np.int32)
+        self.v_delay = np.zeros(8, dtype=np.int64)  # seconds
+        self.v_cur = np.zeros(8, dtype=np.int32)
+        self._dirty = True
+        self._layout()
+
+    # ---------- Registration ----------
+    def set_vehicle(self, rid: int, vid: Hashable, delay_min: int, cur_idx: int,
+                    stops: List[int], epochs: List[int], positions: List[int]) -> None:
+        """Register / replace one vehicle; rows are only re-laid out if its schedule changed."""
+        slot = self._slots.get((rid, vid))
+        if slot is None:
+            slot = self._alloc(rid, vid)
+        block = (stops, epochs, positions)
+        blocks = self._block_map()
+        if blocks.get(slot) != block:
+            blocks[slot] = block
+            self._dirty = True
+            if stops:
+                self._n_stops = max(self._n_stops, max(stops) + 1)
+        self.v_delay[slot] = delay_min * 60
+        self.v_cur[slot] = cur_idx
+
+    def set_state(self, rid: int, vid: Hashable, delay_min: int, cur_idx: int) -> bool:
+        """Update only delay / current index; False if the vehicle is unknown."""
+        slot = self._slots.get((rid, vid))
+        if slot is None:
+            return False
+        self.v_delay[slot] = delay_min * 60
+        self.v_cur[slot] = cur_idx
+        return True
+
+    def drop(self, rid: int, vid: Hashable) -> None:
+        slot = self._slots.pop((rid, vid), None)
+        if slot is None:
+            return
+        self._vids[slot] = None
+        self.v_route[slot] = -1
+        self._free.append(slot)
+        if self._block_map().pop(slot, None) is not None:
+            self._dirty = True
+
+    def __contains__(self, key: Tuple) -> bool:
+        return key in self._slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _alloc(self, rid: int, vid: Hashable) -> int:
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._vids)
+            self._vids.append(None)
+            if slot >= len(self.v_route):
+                n = 2 * len(self.v_route)
+                self.v_route = np.concatenate([self.v_route, np.full(n - slot, -1, dtype=np.int32)])
+                self.v_delay = np.concatenate([self.v_delay, np.zeros(n - slot, dtype=np.int64)])
+                self.v_cur = np.concatenate([self.v_cur, np.zeros(n - slot, dtype=np.int32)])
+        self._slots[(rid, vid)] = slot
+        self._vids[slot] = vid
+        self.v_route[slot] = rid
+        return slot
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if not self._dirty:
+            state["_blocks"] = None   # the row columns hold the same rows
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # row columns are only ever replaced, so they may stay read-only views; these are written in place
+        self.v_route, self.v_delay, self.v_cur = (np.array(a) for a in (self.v_route, self.v_delay, self.v_cur))
+
+    def _block_map(self) -> Dict[int, tuple]:
+        """slot -> (stop ids, epochs, positions), recovered from the laid-out rows after unpickling."""
+        if self._blocks is None:
+            order = np.lexsort((self.r_pos, self.r_veh))
+            veh, stop, epoch, pos = self.r_veh[order], self.r_stop[order], self.r_epoch[order], self.r_pos[order]
+            cuts = np.flatnonzero(np.diff(veh)) + 1
+            self._blocks = {int(v[0]): (s.tolist(), e.tolist(), p.tolist())
+                            for v, s, e, p in zip(*(np.split(a, cuts) for a in (veh, stop, epoch, pos)))
+                            if len(v)}
+        return self._blocks
+
+    # ---------- Row layout ----------
+    def _layout(self) -> None:
+        """Concatenate every vehicle block and group rows by (stop id, route id), then slot and position."""
+        block_map = self._block_map()
+        slots = list(block_map)
+        blocks = [block_map[s] for s in slots]
+        lens = np.fromiter((len(b[0]) for b in blocks), dtype=np.int64, count=len(blocks))
+        total = int(lens.sum()) if len(lens) else 0
+        veh = np.repeat(np.asarray(slots, dtype=np.int32), lens)
+        stop = np.fromiter(chain.from_iterable(b[0] for b in blocks), dtype=np.int32, count=total)
+        epoch = np.fromiter(chain.from_iterable(b[1] for b in blocks), dtype=np.int64, count=total)
+        pos = np.fromiter(chain.from_iterable(b[2] for b in blocks), dtype=np.int32, count=total)
+        route = self.v_route[veh]
+        order = np.lexsort((route, stop))  # lexsort is stable, so slot / position order is kept
+        self.r_veh, self.r_stop, self.r_epoch, self.r_pos = veh[order], stop[order], epoch[order], pos[order]
+        self.r_route = route[order]
+        # rows of stop id s are r_*[bounds[s]:bounds[s + 1]]
+        counts = np.bincount(self.r_stop, minlength=self._n_stops + 1)
+        self._bounds = np.concatenate([[0], np.cumsum(counts)])
+        self._dirty = False
+
+    def prepare(self) -> None:
+        """Lay pending rows out now, so later queries only read (safe to share between threads)."""
+        if self._dirty:
+            self._layout()
+
+    def _segment(self, stop: int, rid: Optional[int] = None):
+        """Slice of the rows at stop (only route rid's rows if given), or None if there are none."""
+        if self._dirty:
+            self._layout()
+        if stop + 1 >= len(self._bounds):
+            return None
+        lo, hi = int(self._bounds[stop]), int(self._bounds[stop + 1])
+        if rid is not None:
+            routes = self.r_route[lo:hi]
+            lo, hi = lo + int(routes.searchsorted(rid, "left")), lo + int(routes.searchsorted(rid, "right"))
+        return slice(lo, hi) if hi > lo else None
+
+    # ---------- Vectorized queries ----------
+    def etas(self, seg=slice(None)):
+        """Scheduled epoch + the owning vehicle's current delay, for rows in seg."""
+        return self.r_epoch[seg] + self.v_delay[self.r_veh[seg]]
+
+    def ahead(self, seg=slice(None)):
+        """Mask of rows in seg at or after their vehicle's current stop index."""
+        return self.r_pos[seg] >= self.v_cur[self.r_veh[seg]]
+
+    def _upcoming(self, stop: int, now: int, rid: Optional[int] = None):
+        """(etas, vehicle slots) of rows at stop still ahead with ETA >= now, sorted by ETA."""
+        seg = self._segment(stop, rid)
+        if seg is None:
+            return None
+        veh = self.r_veh[seg]
+        eta = self.etas(seg)
+        mask = (eta >= now) & self.ahead(seg)
+        eta, veh = eta[mask], veh[mask]
+        order = np.lexsort((veh, eta))
+        return eta[order], veh[order]
+
+    def next_k(self, rid: int, stop: int, now: int, k: int) -> List[Tuple[int, Hashable]]:
+        """Up to k (eta, vid) on route rid at stop with ETA >= now, soonest (then lowest vid) first, one per vehicle."""
+        hit = self._upcoming(stop, now, rid)
+        if hit is None or k <= 0:
+            return []
+        eta, veh = hit
+        _, first = np.unique(veh, return_index=True)  # each vehicle's soonest row
+        first.sort()
+        if len(first) > k:   # keep everything tied with the k-th ETA, the vid decides below
+            first = first[eta[first] <= eta[first[k - 1]]]
+        vids = self._vids
+        rows = sorted((e, vids[s]) for e, s in zip(eta[first].tolist(), veh[first].tolist()))
+        return rows[:k]
+
+    def earliest(self, stop: int, now: int) -> Optional[Tuple[int, int, Hashable]]:
+        """(eta, rid, vid) of the soonest upcoming row at stop over every route."""
+        hit = self._upcoming(stop, now)
+        if hit is None or not len(hit[0]):
+            return None
+        eta, veh = hit
+        tied = veh[:np.searchsorted(eta, eta[0], side="right")].tolist()
+        slot = min(tied, key=self._vids.__getitem__)   # equal ETAs: lowest vid, as in the heaps
+        return int(eta[0]), int(self.v_route[slot]), self._vids[slot]
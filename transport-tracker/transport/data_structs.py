@@ -1,83 +1,183 @@
 class Queue:
-    def __init__(self):
-        self._items = []
-        self._front_index = 0
+    """
+    FIFO queue on a circular buffer that doubles its capacity as soon as the
+    ring fills, so enqueue/dequeue are O(1) and the backing list is never
+    sliced or shifted. head == tail means empty.
+    """
+    __slots__ = ("_items", "_cap", "_head", "_tail")
+
+    def __init__(self, capacity=8):
+        self._cap = max(int(capacity), 1) + 1  # one slot always stays free
+        self._items = [None] * self._cap
+        self._head = 0      # index of the front item
+        self._tail = 0      # index the next item goes to
 
     def enqueue(self, item):
         """Add item to the back of the queue"""
-        self._items.append(item)
+        tail = self._tail
+        self._items[tail] = item
+        tail += 1
+        if tail == self._cap:
+            tail = 0
+        self._tail = tail
+        if tail == self._head:
+            self._grow(self._cap, self._cap * 2)
+
+    def enqueue_many(self, items):
+        """Add every item of an iterable to the back, growing the buffer at most once"""
+        if not isinstance(items, (list, tuple)):
+            items = list(items)
+        n = len(items)
+        if not n:
+            return
+        count = self.size()
+        if count + n >= self._cap:
+            self._grow(count, max(self._cap * 2, count + n + 1))
+        tail = self._tail
+        first = min(n, self._cap - tail)
+        self._items[tail:tail + first] = items[:first]
+        if first < n:
+            self._items[:n - first] = items[first:]
+        self._tail = (tail + n) % self._cap
 
     def dequeue(self):
         """Remove and return item from the front of the queue"""
-        if self.is_empty():
+        head = self._head
+        if head == self._tail:
             raise IndexError("dequeue from empty queue")
-        item = self._items[self._front_index]
-        self._front_index += 1
-        # Compact wasted prefix occasionally
-        if self._front_index > 32 and self._front_index * 2 > len(self._items):
-            self._items = self._items[self._front_index:]
-            self._front_index = 0
+        items = self._items
+        item = items[head]
+        items[head] = None
+        head += 1
+        if head == self._cap:
+            head = 0
+        self._head = head
         return item
 
+    def drain(self, n=None):
+        """Remove and return up to n items (all if n is None) from the front, oldest first"""
+        count = self.size()
+        n = count if n is None else max(0, min(n, count))
+        if not n:
+            return []
+        head = self._head
+        first = min(n, self._cap - head)
+        out = self._items[head:head + first]
+        self._items[head:head + first] = [None] * first
+        if first < n:
+            out += self._items[:n - first]
+            self._items[:n - first] = [None] * (n - first)
+        self._head = (head + n) % self._cap
+        return out
+
     def front(self):
         """Return front item without removing it"""
         if self.is_empty():
             return None
-        return self._items[self._front_index]
+        return self._items[self._head]
 
     def rear(self):
         """Return rear item without removing it"""
         if self.is_empty():
             return None
-        return self._items[-1]
+        return self._items[self._tail - 1]  # index -1 wraps to the last slot
 
     def is_empty(self):
         """Check if queue is empty"""
-        return self._front_index >= len(self._items)
+        return self._head == self._tail
 
     def size(self):
         """Return number of items in queue"""
-        return len(self._items) - self._front_index
+        return (self._tail - self._head) % self._cap
+
+    def _grow(self, count, new_cap):
+        """Move the count queued items (from head) into a new ring of new_cap slots starting at 0"""
+        head = self._head
+        first = min(count, self._cap - head)
+        items = self._items[head:head + first] + self._items[:count - first]
+        items.extend([None] * (new_cap - count))
+        self._items = items
+        self._cap = new_cap
+        self._head = 0
+        self._tail = count
+
+    def __iter__(self):
+        """Iterate front..rear in place (no copy); mutating the queue meanwhile raises"""
+        items, head, tail, cap = self._items, self._head, self._tail, self._cap
+        i = head
+        while i != tail:
+            if self._head != head or self._tail != tail:
+                raise RuntimeError("Queue mutated during iteration")
+            yield items[i]
+            i += 1
+            if i == cap:
+                i = 0
 
     def __len__(self):
         return self.size()
 
 
 class Stack:
+    """
+    LIFO stack. With maxlen the items live in a fixed ring buffer: once full,
+    push overwrites the oldest (bottom) slot in O(1) instead of shifting.
+    """
+
     def __init__(self, maxlen=None):
-        self._items = []
         self._max_length = maxlen
+        self._items = [None] * maxlen if maxlen else []
+        self._start = 0   # ring index of the bottom item (bounded mode)
+        self._count = 0
 
     def push(self, item):
         """Add item to the top of the stack"""
-        self._items.append(item)
-        # Remove oldest item if max length exceeded
-        if self._max_length and len(self._items) > self._max_length:
-            self._items = self._items[1:]
+        if not self._max_length:
+            self._items.append(item)
+            return
+        if self._count < self._max_length:
+            self._items[(self._start + self._count) % self._max_length] = item
+            self._count += 1
+        else:
+            # Overwrite the oldest item when max length is reached
+            self._items[self._start] = item
+            self._start = (self._start + 1) % self._max_length
 
     def pop(self):
         """Remove and return item from the top of the stack"""
         if self.is_empty():
             raise IndexError("pop from empty stack")
-        return self._items.pop()
+        if not self._max_length:
+            return self._items.pop()
+        self._count -= 1
+        idx = (self._start + self._count) % self._max_length
+        item = self._items[idx]
+        self._items[idx] = None
+        return item
 
     def top(self):
         """Return top item without removing it"""
         if self.is_empty():
             return None
-        return self._items[-1]
+        if not self._max_length:
+            return self._items[-1]
+        return self._items[(self._start + self._count - 1) % self._max_length]
 
     def is_empty(self):
         """Check if stack is empty"""
-        return len(self._items) == 0
+        return self.size() == 0
 
     def size(self):
         """Return number of items in stack"""
-        return len(self._items)
+        return self._count if self._max_length else len(self._items)
 
     def to_list(self):
         """Return a shallow copy of items (bottom..top)"""
-        return list(self._items)
+        if not self._max_length:
+            return list(self._items)
+        end = self._start + self._count
+        if end <= self._max_length:
+            return self._items[self._start:end]
+        return self._items[self._start:] + self._items[:end - self._max_length]
 
     def __len__(self):
         return self.size()
@@ -156,74 +256,320 @@ class MinHeap:
             index = smallest_idx
 
 
+class IndexedMinHeap(MinHeap):
+    """
+    MinHeap whose entries carry a key, so one entry can be re-prioritised or
+    removed in O(log n) without rebuilding. remove() takes the entry out
+    eagerly; discard() only tombstones it and the entry is dropped when it
+    surfaces at the top (or when tombstones outnumber live entries).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []       # parallel to _heap
+        self._pos = {}        # key -> index in _heap
+        self._tombstones = set()
+
+    def insert(self, item, key=None):
+        """Add item under key (defaults to the item itself); an existing key is updated"""
+        if key is None:
+            key = item
+        if key in self._pos:
+            self.update_priority(key, item)
+            return
+        self._heap.append(item)
+        self._keys.append(key)
+        self._pos[key] = len(self._heap) - 1
+        self._heapify_up(len(self._heap) - 1)
+
+    def update_priority(self, key, item):
+        """Replace the item stored under key and restore heap order"""
+        idx = self._pos.get(key)
+        if idx is None:
+            self.insert(item, key)
+            return
+        self._tombstones.discard(key)
+        old = self._heap[idx]
+        if old == item:
+            return
+        self._heap[idx] = item
+        if item[0] < old[0]:
+            self._heapify_up(idx)
+        else:
+            self._heapify_down(idx)
+
+    def remove(self, key):
+        """Remove the entry for key now; returns its item (None if absent)"""
+        idx = self._pos.get(key)
+        if idx is None:
+            return None
+        dead = key in self._tombstones
+        self._tombstones.discard(key)
+        item = self._remove_at(idx)
+        return None if dead else item
+
+    def discard(self, key):
+        """Lazily delete: tombstone key, the entry is purged when it reaches the top"""
+        if key in self._pos and key not in self._tombstones:
+            self._tombstones.add(key)
+            if len(self._tombstones) * 2 > len(self._heap):
+                self._compact()
+
+    def contains(self, key):
+        return key in self._pos and key not in self._tombstones
+
+    def get(self, key, default=None):
+        if not self.contains(key):
+            return default
+        return self._heap[self._pos[key]]
+
+    def extract_min(self):
+        """Remove and return the smallest live item"""
+        self._purge_top()
+        if self.is_empty():
+            raise IndexError("extract_min from empty heap")
+        return self._remove_at(0)
+
+    def extract_min_with_key(self):
+        """Like extract_min, but returns (key, item)"""
+        self._purge_top()
+        if self.is_empty():
+            raise IndexError("extract_min from empty heap")
+        key = self._keys[0]
+        return key, self._remove_at(0)
+
+    def peek_min(self):
+        self._purge_top()
+        return super().peek_min()
+
+    def is_empty(self):
+        return len(self._heap) == len(self._tombstones)
+
+    def size(self):
+        return len(self._heap) - len(self._tombstones)
+
+    def smallest(self, k):
+        """Up to k smallest live items in order, without removing anything (O(k log k))"""
+        out = []
+        if k <= 0 or not self._heap:
+            return out
+        frontier = MinHeap()
+        frontier.insert((self._heap[0][0], 0))
+        while not frontier.is_empty() and len(out) < k:
+            _, i = frontier.extract_min()
+            if self._keys[i] not in self._tombstones:
+                out.append(self._heap[i])
+            for child in (self._left_child_index(i), self._right_child_index(i)):
+                if child < len(self._heap):
+                    frontier.insert((self._heap[child][0], child))
+        return out
+
+    def items(self):
+        """Live (key, item) pairs in heap-array order"""
+        for key, item in zip(self._keys, self._heap):
+            if key not in self._tombstones:
+                yield key, item
+
+    def _remove_at(self, idx):
+        last = len(self._heap) - 1
+        item = self._heap[idx]
+        del self._pos[self._keys[idx]]
+        if idx != last:
+            self._heap[idx] = self._heap[last]
+            self._keys[idx] = self._keys[last]
+            self._pos[self._keys[idx]] = idx
+        self._heap.pop()
+        self._keys.pop()
+        if idx < len(self._heap):
+            if idx > 0 and self._heap[idx][0] < self._heap[self._parent_index(idx)][0]:
+                self._heapify_up(idx)
+            else:
+                self._heapify_down(idx)
+        return item
+
+    def _purge_top(self):
+        while self._heap and self._keys[0] in self._tombstones:
+            self._tombstones.discard(self._keys[0])
+            self._remove_at(0)
+
+    def _compact(self):
+        """Drop every tombstoned entry and re-heapify in O(n)"""
+        live = [(k, it) for k, it in zip(self._keys, self._heap) if k not in self._tombstones]
+        self._tombstones = set()
+        self._keys = [k for k, _ in live]
+        self._heap = [it for _, it in live]
+        self._pos = {k: i for i, k in enumerate(self._keys)}
+        for i in range(len(self._heap) // 2 - 1, -1, -1):
+            self._heapify_down(i)
+
+    def _swap(self, i, j):
+        self._heap[i], self._heap[j] = self._heap[j], self._heap[i]
+        self._keys[i], self._keys[j] = self._keys[j], self._keys[i]
+        self._pos[self._keys[i]] = i
+        self._pos[self._keys[j]] = j
+
+
+_EMPTY = -1    # index slot never used
+_DUMMY = -2    # index slot whose entry was removed
+_DELETED = object()  # key placeholder for removed entries in the dense arrays
+
+
+class _MapView:
+    """Lazy view over a HashMap; iterating it does not copy the map."""
+    __slots__ = ("_map",)
+
+    def __init__(self, hmap):
+        self._map = hmap
+
+    def __len__(self):
+        return self._map.size()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
+
+class _KeysView(_MapView):
+    __slots__ = ()
+
+    def __iter__(self):
+        return self._map._iter_keys()
+
+    def __contains__(self, key):
+        return self._map.contains(key)
+
+
+class _ValuesView(_MapView):
+    __slots__ = ()
+
+    def __iter__(self):
+        return self._map._iter_values()
+
+
+class _ItemsView(_MapView):
+    __slots__ = ()
+
+    def __iter__(self):
+        return self._map._iter_items()
+
+    def __contains__(self, item):
+        key, value = item
+        missing = object()
+        return self._map.get(key, missing) == value
+
+
 class HashMap:
+    """
+    Open-addressing map in the compact layout CPython's dict uses: a sparse
+    index table of slots pointing into dense, insertion-ordered arrays of
+    (cached hash, key, value). Hashing uses the built-in hash(); resizing
+    re-slots entries from their cached hashes without re-hashing keys.
+    keys()/values()/items() return lazy views instead of new lists.
+    """
+
     def __init__(self, initial_capacity=16):
-        self._capacity = initial_capacity
+        capacity = 8
+        while capacity < initial_capacity:
+            capacity *= 2
+        self._capacity = capacity
         self._size = 0
-        self._buckets = [[] for _ in range(self._capacity)]
-        self._load_factor_threshold = 0.75
+        self._indices = [_EMPTY] * capacity
+        self._hashes = []
+        self._keys = []
+        self._values = []
+        self._load_factor_threshold = 2 / 3
+
+    def _lookup(self, key, h):
+        """Return (slot, entry) for key; entry is -1 when absent and slot is where it would go."""
+        indices = self._indices
+        mask = self._capacity - 1
+        perturb = h & 0xFFFFFFFFFFFFFFFF
+        i = perturb & mask
+        free = -1
+        while True:
+            ix = indices[i]
+            if ix == _EMPTY:
+                return (i if free < 0 else free), -1
+            if ix == _DUMMY:
+                if free < 0:
+                    free = i
+            elif self._hashes[ix] == h:
+                k = self._keys[ix]
+                if k is key or k == key:
+                    return i, ix
+            perturb >>= 5
+            i = (i * 5 + perturb + 1) & mask
 
     def put(self, key, value):
         """Insert or update key-value pair"""
-        if self._size >= self._capacity * self._load_factor_threshold:
-            self._resize()
-        bucket_index = self._hash(key)
-        bucket = self._buckets[bucket_index]
-        for i, (k, v) in enumerate(bucket):
-            if k == key:
-                bucket[i] = (key, value)
-                return
-        bucket.append((key, value))
+        h = hash(key)
+        slot, ix = self._lookup(key, h)
+        if ix >= 0:
+            self._values[ix] = value
+            return
+        self._indices[slot] = len(self._keys)
+        self._hashes.append(h)
+        self._keys.append(key)
+        self._values.append(value)
         self._size += 1
+        # dense length (live + removed) bounds the used slots, so probing always finds an empty one
+        if len(self._keys) >= self._capacity * self._load_factor_threshold:
+            self._resize()
 
     def get(self, key, default=None):
         """Get value for key, return default if not found"""
-        bucket_index = self._hash(key)
-        bucket = self._buckets[bucket_index]
-        for k, v in bucket:
-            if k == key:
-                return v
+        h = hash(key)
+        mask = self._capacity - 1
+        perturb = h & 0xFFFFFFFFFFFFFFFF
+        i = perturb & mask
+        indices = self._indices
+        ix = indices[i]
+        while ix != -1:  # _EMPTY
+            if ix >= 0 and self._hashes[ix] == h:
+                k = self._keys[ix]
+                if k is key or k == key:
+                    return self._values[ix]
+            perturb >>= 5
+            i = (i * 5 + perturb + 1) & mask
+            ix = indices[i]
         return default
 
     def contains(self, key):
         """Check if key exists in the map"""
-        bucket_index = self._hash(key)
-        bucket = self._buckets[bucket_index]
-        for k, _ in bucket:
-            if k == key:
-                return True
-        return False
+        return self._lookup(key, hash(key))[1] >= 0
 
     def remove(self, key):
         """Remove key-value pair"""
-        bucket_index = self._hash(key)
-        bucket = self._buckets[bucket_index]
-        for i, (k, _) in enumerate(bucket):
-            if k == key:
-                bucket.pop(i)
-                self._size -= 1
-                return
+        slot, ix = self._lookup(key, hash(key))
+        if ix < 0:
+            return
+        self._indices[slot] = _DUMMY
+        self._keys[ix] = _DELETED
+        self._values[ix] = None
+        self._size -= 1
 
     def keys(self):
-        result = []
-        for bucket in self._buckets:
-            for k, _ in bucket:
-                result.append(k)
-        return result
+        return _KeysView(self)
 
     def values(self):
-        result = []
-        for bucket in self._buckets:
-            for _, v in bucket:
-                result.append(v)
-        return result
+        return _ValuesView(self)
 
     def items(self):
-        result = []
-        for bucket in self._buckets:
-            for k, v in bucket:
-                result.append((k, v))
-        return result
+        return _ItemsView(self)
+
+    def _iter_keys(self):
+        for k in self._keys:
+            if k is not _DELETED:
+                yield k
+
+    def _iter_values(self):
+        for k, v in zip(self._keys, self._values):
+            if k is not _DELETED:
+                yield v
+
+    def _iter_items(self):
+        for k, v in zip(self._keys, self._values):
+            if k is not _DELETED:
+                yield k, v
 
     def size(self):
         return self._size
@@ -231,26 +577,90 @@ class HashMap:
     def is_empty(self):
         return self._size == 0
 
-    def _hash(self, key):
-        if key is None:
-            return 0
-        hash_value = 0
-        key_str = str(key)
-        for char in key_str:
-            hash_value = (hash_value * 31 + ord(char)) % self._capacity
-        return hash_value
-
     def _resize(self):
-        old_buckets = self._buckets
-        self._capacity *= 2
-        self._size = 0
-        self._buckets = [[] for _ in range(self._capacity)]
-        for bucket in old_buckets:
-            for key, value in bucket:
-                self.put(key, value)
+        """Compact the dense arrays and re-slot every entry from its cached hash."""
+        capacity = 8
+        while capacity * self._load_factor_threshold <= self._size * 2:
+            capacity *= 2
+        if self._size != len(self._keys):
+            live = [i for i, k in enumerate(self._keys) if k is not _DELETED]
+            self._hashes = [self._hashes[i] for i in live]
+            self._keys = [self._keys[i] for i in live]
+            self._values = [self._values[i] for i in live]
+        indices = [_EMPTY] * capacity
+        mask = capacity - 1
+        for ix, h in enumerate(self._hashes):
+            perturb = h & 0xFFFFFFFFFFFFFFFF
+            i = perturb & mask
+            while indices[i] != _EMPTY:
+                perturb >>= 5
+                i = (i * 5 + perturb + 1) & mask
+            indices[i] = ix
+        self._capacity = capacity
+        self._indices = indices
 
     def __len__(self):
         return self.size()
 
+    def __contains__(self, key):
+        return self.contains(key)
+
     def __iter__(self):
-        return iter(self.items())
+        return self._iter_items()
+
+    # cached hashes are only valid in this process (str hashing is salted) and removed
+    # entries hold a process-local sentinel, so pickles carry the live items and re-insert them
+    def __getstate__(self):
+        return list(self._iter_items())
+
+    def __setstate__(self, items):
+        self.__init__(int(len(items) * 3 / 2) + 1)
+        for key, value in items:
+            self.put(key, value)
+
+
+class SymbolTable:
+    """
+    Interns names to dense integer ids (0, 1, 2, ...) and back, so indexes can
+    be keyed and compared by small ints instead of strings. An optional
+    normalize function maps raw spellings to the interned key; spellings seen
+    through intern() are remembered, so repeated lookups of the same raw string
+    skip normalization entirely.
+    """
+    __slots__ = ("_ids", "_names", "_raw", "_normalize")
+
+    def __init__(self, normalize=None):
+        self._ids = {}      # normalized key -> id
+        self._names = []    # id -> normalized key
+        self._raw = {}      # raw spelling -> id
+        self._normalize = normalize
+
+    def intern(self, name):
+        """Return name's id, assigning the next free one if it is new"""
+        i = self._raw.get(name)
+        if i is not None:
+            return i
+        key = self._normalize(name) if self._normalize else name
+        i = self._ids.get(key)
+        if i is None:
+            i = self._ids[key] = len(self._names)
+            self._names.append(key)
+        self._raw[name] = i
+        return i
+
+    def id(self, name):
+        """Return name's id, or None if it was never interned (nothing is added)"""
+        i = self._raw.get(name)
+        if i is None:
+            i = self._ids.get(self._normalize(name) if self._normalize else name)
+        return i
+
+    def name(self, i):
+        """Return the normalized key for id i"""
+        return self._names[i]
+
+    def __contains__(self, name):
+        return self.id(name) is not None
+
+    def __len__(self):
+        return len(self._names)
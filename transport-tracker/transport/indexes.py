@@ -0,0 +1,324 @@
+import math
+from bisect import bisect_left, insort
+from typing import Dict, Hashable, List, Optional, Tuple
+from .data_structs import HashMap, IndexedMinHeap
+
+
+class ArrivalIndex:
+    """
+    Per-stop arrival heaps that expire on access. Each heap holds
+    (eta, ...) items keyed by an entry key; entries whose ETA is before the
+    `now` passed to a query are popped first, so a snapshot can be held for
+    minutes and still answer "next" correctly without a rebuild.
+
+    Entries are registered per owner (e.g. one vehicle) with set_entries(),
+    which diffs against that owner's previous entries so only changed ETAs
+    touch a heap.
+    """
+
+    def __init__(self):
+        self._heaps = HashMap()   # stop -> IndexedMinHeap
+        self._owned: Dict[Hashable, dict] = {}  # owner -> {key: (stop, item)}
+
+    def set_entries(self, owner: Hashable, entries: dict) -> None:
+        """Replace owner's entries with {key: (stop, item)}; only differences hit the heaps."""
+        old = self._owned.pop(owner, {})
+        if entries:
+            self._owned[owner] = entries
+        for key, (stop, _) in old.items():
+            if key not in entries or entries[key][0] != stop:
+                heap: IndexedMinHeap = self._heaps.get(stop)
+                if heap is not None:
+                    heap.remove(key)
+                    if heap.is_empty():
+                        self._heaps.remove(stop)
+        for key, (stop, item) in entries.items():
+            heap = self._heaps.get(stop)
+            if old.get(key) == (stop, item) and heap is not None and heap.contains(key):
+                continue
+            if heap is None:
+                heap = IndexedMinHeap()
+                self._heaps.put(stop, heap)
+            heap.update_priority(key, item)
+
+    def drop(self, owner: Hashable) -> None:
+        self.set_entries(owner, {})
+
+    def expire(self, stop, now) -> int:
+        """Pop every entry at stop whose ETA is before now; returns how many were dropped."""
+        heap: IndexedMinHeap = self._heaps.get(stop)
+        if heap is None:
+            return 0
+        dropped = 0
+        while not heap.is_empty() and heap.peek_min()[0] < now:
+            heap.extract_min()
+            dropped += 1
+        if heap.is_empty():
+            self._heaps.remove(stop)
+        return dropped
+
+    def next_k(self, stop, now, k: int) -> List[Tuple]:
+        """The k earliest items at stop with ETA >= now, soonest first."""
+        self.expire(stop, now)
+        heap: IndexedMinHeap = self._heaps.get(stop)
+        if heap is None:
+            return []
+        return heap.smallest(k)
+
+    def earliest(self, stop, now) -> Optional[Tuple]:
+        items = self.next_k(stop, now, 1)
+        return items[0] if items else None
+
+    def stops(self):
+        return self._heaps.keys()
+
+    def __contains__(self, stop) -> bool:
+        return self._heaps.contains(stop)
+
+    def __len__(self) -> int:
+        return self._heaps.size()
+
+
+class StopTimelines:
+    """
+    Per-(route, stop) timelines: sorted lists of (eta_epoch, vid, pos) with the
+    vehicle's delay already applied and only schedule positions it has not
+    passed yet. "Next arrivals" is a bisect on now plus a short forward scan.
+
+    Like ArrivalIndex, entries are registered per owner (one vehicle) and
+    set_entries() only inserts / deletes the rows that changed.
+    """
+
+    def __init__(self):
+        self._lines: Dict[Hashable, list] = {}   # (rid, stop) -> sorted [(eta, vid, pos)]
+        self._owned: Dict[Hashable, dict] = {}   # owner -> {(rid, stop): [(eta, vid, pos)]}
+
+    def set_entries(self, owner: Hashable, entries: Dict[Hashable, list]) -> None:
+        """Replace owner's rows with {line_key: [(eta, vid, pos), ...]}."""
+        old = self._owned.pop(owner, {})
+        if entries:
+            self._owned[owner] = entries
+        for line_key in set(old) | set(entries):
+            before = old.get(line_key, [])
+            after = entries.get(line_key, [])
+            if before == after:
+                continue
+            line = self._lines.setdefault(line_key, [])
+            keep = set(after)
+            for row in before:
+                if row not in keep:
+                    i = bisect_left(line, row)
+                    if i < len(line) and line[i] == row:
+                        del line[i]
+            had = set(before)
+            for row in after:
+                if row not in had:
+                    insort(line, row)
+            if not line:
+                del self._lines[line_key]
+
+    def drop(self, owner: Hashable) -> None:
+        self.set_entries(owner, {})
+
+    def next_k(self, line_key: Hashable, now: int, k: int) -> List[Tuple[int, str]]:
+        """Up to k (eta, vid) at or after now, soonest first, one (the next) per vehicle."""
+        line = self._lines.get(line_key)
+        if not line or k <= 0:
+            return []
+        out = []
+        seen = set()
+        for i in range(bisect_left(line, (now,)), len(line)):
+            eta, vid, _ = line[i]
+            if vid in seen:
+                continue
+            seen.add(vid)
+            out.append((eta, vid))
+            if len(out) >= k:
+                break
+        return out
+
+    def first(self, line_key: Hashable, now: int) -> Optional[Tuple[int, str]]:
+        hits = self.next_k(line_key, now, 1)
+        return hits[0] if hits else None
+
+
+class StopIndex:
+    """
+    Global stop-name index for prefix search. Every normalized stop name is
+    stored in one sorted list under the full name and under each word start
+    ("mount lavinia" also as "lavinia"), so all names with a given prefix are a
+    bisect plus a contiguous scan. Each stop also tracks the routes serving it;
+    routes are registered with set_route(), which only touches stops that
+    gained or lost their last route.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[str, int]] = []        # sorted (name or word suffix, stop id)
+        self._names: Dict[int, Tuple[str, str]] = {}  # stop id -> (normalized, Canonical)
+        self._routes: Dict[int, set] = {}             # stop id -> route ids serving it
+        self._by_route: Dict[Hashable, Dict[int, Tuple[str, str]]] = {}  # route -> {stop id: names}
+
+    @staticmethod
+    def _suffixes(norm: str) -> List[str]:
+        words = norm.split()
+        return [norm] + [" ".join(words[i:]) for i in range(1, len(words))]
+
+    def set_route(self, route: Hashable, stops: Dict[int, Tuple[str, str]]) -> None:
+        """Replace the stops route serves with {stop id: (normalized, Canonical)}."""
+        old = self._by_route.pop(route, {})
+        if stops:
+            self._by_route[route] = stops
+        for sid in old.keys() - stops.keys():
+            served = self._routes.get(sid)
+            if served is None:
+                continue
+            served.discard(route)
+            if not served:
+                del self._routes[sid]
+                norm, _ = self._names.pop(sid)
+                for key in self._suffixes(norm):
+                    i = bisect_left(self._keys, (key, sid))
+                    if i < len(self._keys) and self._keys[i] == (key, sid):
+                        del self._keys[i]
+        for sid, names in stops.items():
+            served = self._routes.get(sid)
+            if served is None:
+                served = self._routes[sid] = set()
+                self._names[sid] = names
+                for key in self._suffixes(names[0]):
+                    insort(self._keys, (key, sid))
+            served.add(route)
+
+    def drop(self, route: Hashable) -> None:
+        self.set_route(route, {})
+
+    def canonical(self, sid: int) -> Optional[str]:
+        names = self._names.get(sid)
+        return names[1] if names else None
+
+    def routes(self, sid: int) -> set:
+        return self._routes.get(sid, set())
+
+    def search(self, prefix: str, limit: int = 10) -> List[Tuple[int, str, set]]:
+        """
+        Up to limit (stop id, Canonical, route ids) whose name or one of its
+        words starts with the normalized prefix. Ranked: exact name, then name
+        prefix, then word prefix; ties go to stops served by more routes.
+        """
+        if not prefix or limit <= 0:
+            return []
+        keys = self._keys
+        best: Dict[int, int] = {}
+        for i in range(bisect_left(keys, (prefix,)), len(keys)):
+            key, sid = keys[i]
+            if not key.startswith(prefix):
+                break
+            norm = self._names[sid][0]
+            rank = 0 if norm == prefix else 1 if key == norm else 2
+            if rank < best.get(sid, 3):
+                best[sid] = rank
+        ranked = sorted(best, key=lambda s: (best[s], -len(self._routes[s]), self._names[s][0]))
+        return [(sid, self._names[sid][1], self._routes[sid]) for sid in ranked[:limit]]
+
+    def __contains__(self, sid: int) -> bool:
+        return sid in self._names
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+_EARTH_RADIUS_M = 6_371_000.0
+_M_PER_DEG_LAT = 111_320.0
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in metres."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * _EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GeoGrid:
+    """
+    Uniform lat/lng grid of points (stop id -> (lat, lng)). nearby() visits
+    cells in growing square rings around the query point and stops as soon as
+    the ring is farther than the radius, or than the k-th hit found so far, so
+    a "what's near me" query only looks at the few cells around the caller.
+    """
+
+    def __init__(self, cell_deg: float = 0.01):   # ~1.1 km of latitude per cell
+        self.cell_deg = cell_deg
+        self._points: Dict[Hashable, Tuple[float, float]] = {}
+        self._cells: Dict[Tuple[int, int], set] = {}
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def put(self, key: Hashable, lat: float, lng: float) -> None:
+        self.remove(key)
+        self._points[key] = (lat, lng)
+        self._cells.setdefault(self._cell(lat, lng), set()).add(key)
+
+    def remove(self, key: Hashable) -> None:
+        old = self._points.pop(key, None)
+        if old is None:
+            return
+        cell = self._cell(*old)
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._cells[cell]
+
+    def get(self, key: Hashable) -> Optional[Tuple[float, float]]:
+        return self._points.get(key)
+
+    def nearby(self, lat: float, lng: float, radius_m: float, k: int) -> List[Tuple[float, Hashable]]:
+        """Up to k (distance_m, key) within radius_m of (lat, lng), closest first."""
+        if k <= 0 or not self._points:
+            return []
+        ci, cj = self._cell(lat, lng)
+        # metres covered by one cell step (longitude cells shrink towards the poles)
+        step_m = self.cell_deg * _M_PER_DEG_LAT * max(math.cos(math.radians(min(abs(lat), 89.0))), 0.01)
+        max_ring = int(radius_m // step_m) + 1
+        hits: List[Tuple[float, Hashable]] = []
+        if (2 * max_ring + 1) ** 2 > len(self._cells):
+            # the radius covers more cells than are occupied: checking every point is cheaper
+            for key, (plat, plng) in self._points.items():
+                d = haversine_m(lat, lng, plat, plng)
+                if d <= radius_m:
+                    hits.append((d, key))
+            hits.sort()
+            return hits[:k]
+        for ring in range(max_ring + 1):
+            # nothing in this ring is closer than (ring - 1) whole cells
+            if ring and (ring - 1) * step_m > radius_m:
+                break
+            if len(hits) >= k and (ring - 1) * step_m > hits[k - 1][0]:
+                break
+            for cell in self._ring(ci, cj, ring):
+                for key in self._cells.get(cell, ()):
+                    d = haversine_m(lat, lng, *self._points[key])
+                    if d <= radius_m:
+                        insort(hits, (d, key))
+            del hits[k:]
+        return hits
+
+    @staticmethod
+    def _ring(ci: int, cj: int, r: int):
+        if r == 0:
+            yield ci, cj
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._points
+
+    def __len__(self) -> int:
+        return len(self._points)
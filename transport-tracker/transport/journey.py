@@ -0,0 +1,130 @@
+from bisect import bisect_left
+from typing import Dict, Hashable, List, Optional, Tuple
+from .data_structs import SymbolTable
+
+# (dep_epoch, arr_epoch, from stop id, to stop id, schedule position) as registered by a vehicle
+Hop = Tuple[int, int, int, int, int]
+# the same plus the owning trip's interned id, as stored in the scan array
+Connection = Tuple[int, int, int, int, int, int]
+
+_INF = float("inf")
+
+
+class ConnectionScan:
+    """
+    Earliest-arrival journey planner (Connection Scan Algorithm) over one
+    time-sorted array of connections: every hop between two consecutive
+    schedule entries of a vehicle, with its delay applied. A query is a single
+    forward pass from the departure time, stopping once connections leave
+    after the best arrival found at the destination.
+
+    Connections are registered per owner (one vehicle) with set_entries(),
+    which only deletes / inserts the hops that changed, so a delay report or
+    departure does not re-sort the whole network. A fresh instance collects
+    entries unsorted and sorts once on first use, so a full snapshot load is a
+    single sort rather than one insort per connection. Connections leaving
+    in the same second are kept in owner order (owners must be orderable), so
+    ties between equally fast journeys are broken the same way however the
+    array was built.
+    """
+
+    def __init__(self, min_transfer_s: int = 120):
+        self.min_transfer_s = min_transfer_s
+        self._conns: Optional[List[Connection]] = None  # None until first use
+        self._owned: Dict[int, List[Connection]] = {}   # trip id -> its connections
+        self._trips = SymbolTable()                      # owner (e.g. (route id, vid)) -> trip id
+
+    def set_entries(self, owner: Hashable, hops: List[Hop]) -> None:
+        """Replace owner's hops; only the changed ones move in the sorted array."""
+        trip = self._trips.intern(owner)
+        conns = [(dep, arr, frm, to, trip, pos) for dep, arr, frm, to, pos in hops]
+        old = self._owned.pop(trip, [])
+        if conns:
+            self._owned[trip] = conns
+        if old == conns or self._conns is None:
+            return
+        # (dep,) finds the start of one departure's run, which is short
+        line = self._conns
+        keep = set(conns)
+        for c in old:
+            if c not in keep:
+                i = bisect_left(line, (c[0],))
+                while i < len(line) and line[i][0] == c[0]:
+                    if line[i] == c:
+                        del line[i]
+                        break
+                    i += 1
+        had = set(old)
+        name = self._trips.name
+        for c in conns:
+            if c not in had:
+                i = bisect_left(line, (c[0],))
+                while i < len(line) and line[i][0] == c[0] and (name(line[i][4]), line[i][5]) < (owner, c[5]):
+                    i += 1
+                line.insert(i, c)
+
+    def drop(self, owner: Hashable) -> None:
+        self.set_entries(owner, [])
+
+    def prepare(self) -> None:
+        """Sort now rather than on the first query, so queries only read."""
+        self._sorted()
+
+    def _sorted(self) -> List[Connection]:
+        if self._conns is None:
+            name = self._trips.name
+            self._conns = sorted((c for conns in self._owned.values() for c in conns),
+                                 key=lambda c: (c[0], name(c[4]), c[5]))
+        return self._conns
+
+    def __len__(self) -> int:
+        return sum(len(c) for c in self._owned.values())
+
+    def earliest_arrival(self, source: int, target: int,
+                         depart_after: int) -> Optional[List[Tuple[Hashable, List[Hop]]]]:
+        """
+        Legs (owner, hops ridden on it) of an earliest-arrival journey from
+        source to target leaving at or after depart_after, or None.
+        Changing vehicles needs min_transfer_s at the transfer stop.
+        """
+        if source == target:
+            return []
+        conns = self._sorted()
+        arrival: Dict[int, int] = {source: depart_after - self.min_transfer_s}  # no transfer at the start
+        boarded: Dict[int, int] = {}                  # trip -> index of its first connection we ride
+        reached_by: Dict[int, Tuple[int, int]] = {}   # stop -> (boarding index, alighting index)
+        transfer = self.min_transfer_s
+        best = _INF
+        for i in range(bisect_left(conns, (depart_after,)), len(conns)):
+            c = conns[i]
+            if c[0] >= best:
+                break
+            trip = c[4]
+            if trip not in boarded:
+                ready = arrival.get(c[2])
+                if ready is None or ready + transfer > c[0]:
+                    continue
+                boarded[trip] = i
+            to = c[3]
+            if c[1] < arrival.get(to, _INF):
+                arrival[to] = c[1]
+                reached_by[to] = (boarded[trip], i)
+                if to == target:
+                    best = c[1]
+        if target not in reached_by:
+            return None
+
+        legs = []
+        stop = target
+        while stop != source:
+            first, last = reached_by[stop]
+            legs.append(self._ride(conns[first], conns[last]))
+            stop = conns[first][2]
+        legs.reverse()
+        return legs
+
+    def _ride(self, first: Connection, last: Connection) -> Tuple[Hashable, List[Hop]]:
+        """(owner, hops) of one trip from connection first through last, in travel order."""
+        trip, start, end = first[4], first[5], last[5]
+        hops = sorted((c for c in self._owned.get(trip, []) if start <= c[5] <= end), key=lambda c: c[5])
+        return self._trips.name(trip), [(dep, arr, frm, to, pos) for dep, arr, frm, to, _, pos in hops]
@@ -1,7 +1,20 @@
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime, timedelta, timezone
 from typing import List, Tuple, Optional, Dict
 from firebase_init import init_firebase, rtdb_ref
-from .data_structs import Queue, MinHeap, HashMap, Stack
+from . import metrics, persist
+from .shared import HAVE_SHARED, SharedSnapshot
+from .data_structs import HashMap, SymbolTable
+from .columnar import HAVE_NUMPY, ScheduleColumns
+from .journey import ConnectionScan
+from .indexes import ArrivalIndex, GeoGrid, StopIndex, StopTimelines
+from .reports import RecentReports
+from .sessions import RecentSearches
+from .stream import RouteStreamHub, RouteVersions, Subscription
 
 init_firebase()
 
@@ -17,58 +30,1017 @@ def _norm_route(r: str) -> str:
 def _norm_stop(s: str) -> str:
     return (s or "").strip().lower()
 
-class TransportManagerFB:
-    def __init__(self):
+class _NoAdvance(Exception):
+    """Raised inside a departure transaction to abort it without writing."""
+
+def _use_columns() -> bool:
+    return HAVE_NUMPY and os.environ.get("SCHEDULE_COLUMNAR", "1") != "0"
+
+def _shard_vehicles() -> bool:
+    return os.environ.get("SNAPSHOT_SHARD_VEHICLES", "0") == "1"
+
+def _env_seconds(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+def _fetch_timeout() -> float:
+    return _env_seconds("SNAPSHOT_FETCH_TIMEOUT", 10.0)
+
+_FETCH_WORKERS = 8
+
+# vehicle fields that only move ETAs, not schedule rows
+_STATE_FIELDS = {"delayMinutes", "currentStopIndex"}
+
+# ---------- Metrics (exported at /api/metrics) ----------
+_QUERY_SECONDS = metrics.REGISTRY.histogram("transport_query_duration_seconds",
+                                            "Wall time of manager queries against the snapshot, by method.", ("method",))
+_PHASE_SECONDS = metrics.REGISTRY.histogram(
+    "transport_snapshot_phase_seconds",
+    "Snapshot refresh time by phase: fetch (full reload), build (indexing the next copy), "
+    "swap (waiting out readers of the old one), replay (bringing the old one level).", ("phase",))
+_REFRESHES = metrics.REGISTRY.counter("transport_snapshot_reloads_total", "Full reloads from the database, by result.",
+                                      ("result",))
+_SNAPSHOT_AGE = metrics.REGISTRY.gauge("transport_snapshot_age_seconds",
+                                       "Seconds since the published snapshot was last known current.")
+_SNAPSHOT_VERSION = metrics.REGISTRY.gauge("transport_snapshot_version", "Publish count of the snapshot in use.")
+_SNAPSHOT_ENTRIES = metrics.REGISTRY.gauge("transport_snapshot_entries", "Entries in the published snapshot.", ("kind",))
+_SNAPSHOT_BYTES = metrics.REGISTRY.gauge("transport_snapshot_bytes",
+                                         "Serialized size of the snapshot as last saved or shared.")
+
+def _observe_phase(phase: str, since: float) -> float:
+    """Record the time since `since` under phase; returns now, to time the next phase from."""
+    now = time.perf_counter()
+    _PHASE_SECONDS.observe(now - since, phase)
+    return now
+
+def _split_path(path: str) -> List[str]:
+    return [p for p in (path or "/").split("/") if p]
+
+def _set_in(tree, parts: List[str], value) -> None:
+    """
+    Write value at parts inside a raw RTDB tree (None deletes), like a listener
+    'put'. Only `tree` itself changes in place: containers below it on the path
+    are replaced by updated copies, so a route or vehicle dict already handed
+    to a published snapshot never changes under its readers.
+    """
+    key = parts[0]
+    if len(parts) == 1:
+        _put(tree, key, value)
+        return
+    child = _get(tree, key)
+    if isinstance(child, dict):
+        child = dict(child)
+    elif isinstance(child, list):
+        child = list(child)
+    elif value is None:
+        return
+    else:
+        child = {}
+    _set_in(child, parts[1:], value)
+    _put(tree, key, child)
+
+def _get_in(tree, parts: List[str]):
+    node = tree
+    for key in parts:
+        if not isinstance(node, (dict, list)):
+            return None
+        node = _get(node, key)
+    return node
+
+def _get(node, key: str):
+    if isinstance(node, list):
+        idx = int(key)
+        return node[idx] if idx < len(node) else None
+    return node.get(key)
+
+def _put(node, key: str, value) -> None:
+    if isinstance(node, list):
+        idx = int(key)
+        if value is None:
+            if idx < len(node):
+                node[idx] = None
+            return
+        while len(node) <= idx:
+            node.append(None)
+        node[idx] = value
+    elif value is None:
+        node.pop(key, None)
+    else:
+        node[key] = value
+
+def _compact(ops: List[tuple]) -> List[tuple]:
+    """
+    Pending index ops with repeats merged (each op re-reads the raw tree, so
+    once is enough) and everything before the last full rebuild dropped.
+    A vehicle op is state-only only if every merged copy was.
+    """
+    for i in range(len(ops) - 1, -1, -1):
+        if ops[i][0] == "all":
+            ops = ops[i:]
+            break
+    merged: Dict[tuple, tuple] = {}
+    for op in ops:
+        if op[0] == "vehicle":
+            prev = merged.get(op[:3])
+            merged[op[:3]] = op if prev is None else op[:3] + (prev[3] and op[3],)
+        else:
+            merged.setdefault(op, op)
+    return list(merged.values())
+
+class _Snapshot:
+    """
+    One complete set of read structures. The manager keeps two: readers pin
+    the published one for the length of a call, the writer applies changes to
+    the other and swaps (see TransportManagerFB._flush).
+    """
+
+    INDEXES = ("routes", "vehicles", "route_syms", "stop_syms", "arrivals", "timelines", "stop_index",
+               "geo", "journeys", "columns", "route_alias", "stop_alias", "route_vids")
+
+    def __init__(self, columnar: bool):
         self.routes = HashMap()           # rid -> {routeName, stops[]}
         self.vehicles = HashMap()         # rid -> {vid -> vehicle}
-        self.stop_heaps = HashMap()       # norm_stop -> MinHeap[(eta_dt, rid, vid)]
-        self.recent_searches = Stack(maxlen=20)
+        # internal indexes are keyed by interned ints; names are resolved only at the API edge
+        self.route_syms = SymbolTable()            # rid -> route id
+        self.stop_syms = SymbolTable(_norm_stop)   # any spelling of a stop -> stop id
+        self.arrivals = ArrivalIndex()    # stop id -> expiring heap of (eta_dt, route id, vid), keyed (route id, vid, pos)
+        self.timelines = StopTimelines()  # (route id, stop id) -> sorted [(eta_epoch, vid, pos)]
+        self.stop_index = StopIndex()     # stop name / word prefixes -> stop ids and the routes serving them
+        self.geo = GeoGrid()              # stop id -> (lat, lng), bucketed for nearby queries
+        self.journeys = ConnectionScan()  # time-sorted hops between consecutive stops of every vehicle
+        # with numpy, schedule rows live here instead of arrivals / timelines
+        self.columns: Optional[ScheduleColumns] = ScheduleColumns() if columnar else None
         self.route_alias: Dict[str, str] = {}
-        self.stop_alias: Dict[str, Dict[str, str]] = {}  # rid -> {norm: Canonical}
+        self.stop_alias: Dict[str, Dict[int, str]] = {}  # rid -> {stop id: Canonical}
+        self.route_vids: Dict[str, set] = {}   # rid -> vids that have index entries
+        self.version = 0          # publish count; 0 = never published
+        self.fresh_at = 0.0       # wall time its data was last known current
+        self.readers = 0          # calls currently pinned to it
+        self.expire_lock = threading.Lock()  # ArrivalIndex expires on read
+        self.source: Optional[str] = None  # "file" / "shared" if loaded as is rather than built here
+
+    def indexes(self) -> dict:
+        return {name: getattr(self, name) for name in self.INDEXES}
+
+def _snapshot_field(name: str) -> property:
+    """Manager attribute backed by the calling thread's pinned snapshot."""
+    return property(lambda self: getattr(self._pinned(), name),
+                    lambda self, value: setattr(self._pinned(), name, value))
+
+def _reads(method):
+    """Run a query against one pinned snapshot; nested queries reuse the caller's pin."""
+    @functools.wraps(method)
+    def pinned(self, *args, **kwargs):
+        if getattr(self._local, "snap", None) is not None:
+            return method(self, *args, **kwargs)
+        started = time.perf_counter()
+        snap = self._pin()
+        self._local.snap = snap
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._local.snap = None
+            self._unpin(snap)
+            _QUERY_SECONDS.observe(time.perf_counter() - started, method.__name__)
+    return pinned
+
+class TransportManagerFB:
+    # index structures live in the snapshot pinned by the current call (see _Snapshot)
+    routes = _snapshot_field("routes")
+    vehicles = _snapshot_field("vehicles")
+    route_syms = _snapshot_field("route_syms")
+    stop_syms = _snapshot_field("stop_syms")
+    arrivals = _snapshot_field("arrivals")
+    timelines = _snapshot_field("timelines")
+    stop_index = _snapshot_field("stop_index")
+    geo = _snapshot_field("geo")
+    journeys = _snapshot_field("journeys")
+    columns = _snapshot_field("columns")
+    route_alias = _snapshot_field("route_alias")
+    stop_alias = _snapshot_field("stop_alias")
+    _route_vids = _snapshot_field("route_vids")
+
+    def __init__(self):
+        columnar = _use_columns()
+        self._front = _Snapshot(columnar)   # published: what readers pin
+        self._back = _Snapshot(columnar)    # the writer's copy
+        self._local = threading.local()
+        self._readers = threading.Condition()
+        self._pending: List[tuple] = []     # index ops not yet published
+        self._write_lock = threading.Lock()
+        self.max_age = _env_seconds("SNAPSHOT_MAX_AGE", 60.0)             # staleness bound, seconds
+        self.refresh_interval = _env_seconds("SNAPSHOT_REFRESH_S", 15.0)  # polled reloads without listeners
+        self.snapshot_file = os.environ.get("SNAPSHOT_FILE", "")           # warm-start file; empty = off
+        self.save_interval = _env_seconds("SNAPSHOT_SAVE_S", 30.0)
+        self._saved: Tuple[float, int] = (0.0, 0)                         # (monotonic time, version) of last save
+        self._save_lock = threading.Lock()
+        # SNAPSHOT_SHM=<name>: one worker process publishes for all the others on this host;
+        # SNAPSHOT_SHM_KEY: shared secret its snapshots are signed with (default: a key file per host user)
+        shm = os.environ.get("SNAPSHOT_SHM", "")
+        key = os.environ.get("SNAPSHOT_SHM_KEY", "").encode() or None
+        self.shared = SharedSnapshot(shm, key) if shm and HAVE_SHARED else None
+        self.share_interval = _env_seconds("SNAPSHOT_SHARE_S", 1.0)
+        self._published: Tuple[float, int] = (0.0, 0)                     # (monotonic time, version) of last publish
+        self._shared_versions: Dict[str, tuple] = {}                      # publisher's rid -> (meta, data) versions
+        self._refresher: Optional[threading.Thread] = None
+        self._refresher_stop = threading.Event()
+        self._wake = threading.Event()
+        self.recent_searches = RecentSearches(per_session=20)  # session id -> bounded Stack
+        self.reports = RecentReports(self._fetch_reports, per_route=100)  # rid -> ring of newest reports
+        self.versions = RouteVersions()   # rid -> version, bumped whenever that route's snapshot changes
+        self.route_streams = RouteStreamHub(self.versions, self._render_route_stream)
+        self.route_meta = RouteVersions()  # rid -> version of its route entry (name, stops) only
+        self.instance_id = os.urandom(4).hex()  # versions restart at 0, so validators also name the process
+
+        # long-lived raw trees kept current by change listeners
+        self._raw_routes: dict = {}
+        self._raw_vehicles: dict = {}
+        self._raw_geo: dict = {}
+        self._raw_fresh_at = 0.0   # when the raw trees were last known current (polled, loaded or a listener event)
+        self._listeners = []
+        self._listening = False    # listener events may arrive (set before the first one is attached)
+        self._primed: Dict[str, threading.Event] = {}
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
 
     # ---------- Cache refresh from Firebase ----------
-    def refresh_from_db(self):
-        # routes
-        routes = rtdb_ref("/routes").get() or {}
+    def refresh_from_db(self, timeout: Optional[float] = None):
+        """
+        Full reload of /routes, /vehicles and /stopsGeo (fallback when listeners are unavailable).
+        The subtrees are fetched concurrently, so a reload costs about the slowest
+        round trip rather than their sum; each fetch gets `timeout` seconds
+        (SNAPSHOT_FETCH_TIMEOUT, default 10) and a failure leaves the snapshot as it was.
+        Only what differs from the trees already held is re-indexed, so an
+        unchanged reload bumps no route version.
+        """
+        started, t = time.time(), time.perf_counter()
+        try:
+            routes, vehicles_tree, geo = self._fetch_trees(_fetch_timeout() if timeout is None else timeout)
+        except Exception:
+            _REFRESHES.inc("error")
+            raise
+        _PHASE_SECONDS.observe(time.perf_counter() - t, "fetch")
+        _REFRESHES.inc("ok")
+        routes, vehicles_tree = dict(routes), dict(vehicles_tree)
+        geo = dict(geo) if isinstance(geo, dict) else {}
+        with self._lock:
+            if not self._front.version or self._front.source is not None:
+                ops = [("all",)]   # nothing built here yet to diff against
+            else:
+                ops = self._reload_ops(routes, vehicles_tree, geo)
+            self._raw_routes, self._raw_vehicles, self._raw_geo = routes, vehicles_tree, geo
+            self._raw_fresh_at = started
+            self._pending.extend(ops)
+        if not self._flush():
+            self._front.fresh_at = max(self._front.fresh_at, started)   # unchanged, but known current now
+
+    def _reload_ops(self, routes: dict, vehicles: dict, geo: dict) -> List[tuple]:
+        """Index ops for the parts of freshly fetched trees that differ from the held raw trees."""
+        ops: List[tuple] = []
+        for rid in set(routes) | set(self._raw_routes) | set(vehicles) | set(self._raw_vehicles):
+            old_v, new_v = self._raw_vehicles.get(rid), vehicles.get(rid)
+            if routes.get(rid) != self._raw_routes.get(rid):
+                ops.append(("route", rid))
+            elif old_v == new_v:
+                continue
+            elif isinstance(old_v, dict) and isinstance(new_v, dict) and rid in routes:
+                for vid in set(old_v) | set(new_v):
+                    a, b = old_v.get(vid), new_v.get(vid)
+                    if a != b:
+                        state_only = (isinstance(a, dict) and isinstance(b, dict) and
+                                      all(a.get(f) == b.get(f) for f in set(a) | set(b) if f not in _STATE_FIELDS))
+                        ops.append(("vehicle", rid, vid, state_only))
+            else:
+                ops.append(("route", rid))
+        ops.extend(("geo", name) for name in set(geo) | set(self._raw_geo)
+                   if geo.get(name) != self._raw_geo.get(name))
+        return ops
+
+    def _fetch_trees(self, timeout: float) -> Tuple[dict, dict, dict]:
+        """
+        (routes, vehicles, stopsGeo) fetched on a thread pool. With
+        SNAPSHOT_SHARD_VEHICLES=1, /vehicles is read as a shallow key list and
+        then one request per route, so a large network downloads in parallel.
+        A fetch's timeout runs from when a worker starts it, so shards queued
+        behind the pool never time out just for waiting their turn.
+        """
+        pool = ThreadPoolExecutor(max_workers=_FETCH_WORKERS, thread_name_prefix="snapshot-fetch")
+
+        def fetch(path: str, shallow: bool = False):
+            ref, started = rtdb_ref(path), []
+
+            def call():
+                started.append(time.monotonic())
+                return ref.get(shallow=True) if shallow else ref.get()
+            return pool.submit(call), started
+
+        def wait(job, path: str):
+            future, started = job
+            while True:
+                # still queued: wait a full timeout, then look again
+                left = started[0] + timeout - time.monotonic() if started else timeout
+                try:
+                    return future.result(max(0.0, left))
+                except FutureTimeout:
+                    if started and time.monotonic() >= started[0] + timeout:
+                        raise TimeoutError(f"fetching {path} took longer than {timeout:g}s") from None
+
+        try:
+            routes = fetch("/routes")
+            geo = fetch("/stopsGeo")
+            if _shard_vehicles():
+                keys = wait(fetch("/vehicles", shallow=True), "/vehicles") or {}
+                shards = {rid: fetch(f"/vehicles/{rid}") for rid in keys}
+                vehicles = {rid: wait(job, f"/vehicles/{rid}") for rid, job in shards.items()}
+                vehicles = {rid: v for rid, v in vehicles.items() if v is not None}
+            else:
+                vehicles = wait(fetch("/vehicles"), "/vehicles") or {}
+            return wait(routes, "/routes") or {}, vehicles, wait(geo, "/stopsGeo") or {}
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)  # a timed-out call is abandoned, not waited for
+
+    def sync(self, timeout: float = 10.0) -> None:
+        """
+        Make sure a snapshot is published and the background refresher runs;
+        requests then only read the snapshot pointer. The first call loads:
+        change listeners on /routes, /vehicles and /stopsGeo, or, if they cannot
+        be started, a full reload now and every `refresh_interval` seconds.
+        Later calls do no I/O unless the snapshot is older than `max_age` (the
+        refresher is failing); then one caller retries a reload in line while
+        the others keep serving the stale snapshot. With SNAPSHOT_SHM set, only
+        the publishing worker loads; the others follow its shared snapshot.
+        """
+        if self._refresher is not None and self.snapshot_age() <= self.max_age:
+            return
+        if self._refresher is None:
+            with self._sync_lock:
+                if self._refresher is None:
+                    if self.shared is not None and not self.shared.lead():
+                        self._follow(timeout)
+                        self._start_refresher()
+                    elif not self._front.version and self.load_snapshot():
+                        # warm start: serve the saved snapshot now, connect in the background
+                        self._start_refresher(connect_timeout=timeout)
+                    else:
+                        self._connect(timeout)
+                        self._start_refresher()
+            return
+        if self.shared is not None and not self.shared.leading:
+            return   # the publisher is failing too; the refresher takes over if it exits
+        if self._sync_lock.acquire(blocking=False):
+            try:
+                self.refresh_from_db(timeout)
+            except Exception:
+                pass
+            finally:
+                self._sync_lock.release()
+
+    def _connect(self, timeout: float) -> None:
+        """Attach listeners and publish their data, or fall back to one full reload."""
+        try:
+            self._start_listeners(timeout)
+            self._flush()
+        except Exception:
+            self._stop_listeners()
+            self.refresh_from_db()
+
+    def close(self) -> None:
+        """Stop change listeners and the refresher (the next sync() starts them again)."""
+        self._stop_listeners()
+        if self._refresher is not None:
+            self._refresher_stop.set()
+            self._wake.set()
+            self._refresher = None
+        if self.shared is not None:
+            self.shared.close()
+
+    def _stop_listeners(self) -> None:
+        self._listening = False
+        listeners, self._listeners = self._listeners, []
+        for reg in listeners:
+            try:
+                reg.close()
+            except Exception:
+                pass
+
+    def snapshot_age(self) -> float:
+        """Seconds since the published snapshot's data was last known current (inf before the first load)."""
+        front = self._front
+        return max(0.0, time.time() - front.fresh_at) if front.version else float("inf")
+
+    def snapshot_info(self) -> dict:
+        age = self.snapshot_age()
+        info = {
+            "version": self._front.version,
+            "ageSeconds": round(age, 3) if age != float("inf") else None,
+            "stale": age > self.max_age,
+            "source": self._front.source or ("listeners" if self._listeners else "polling"),
+        }
+        if self.shared is not None:
+            info["shared"] = {"name": self.shared.name, "publisher": self.shared.leading,
+                              "generation": self.shared.generation}
+        return info
+
+    def update_metrics(self) -> None:
+        """Set the snapshot gauges (age, version, entry counts) from the published snapshot; call before a scrape."""
+        snap = self._pin()
+        try:
+            _SNAPSHOT_AGE.set(self.snapshot_age())
+            _SNAPSHOT_VERSION.set(snap.version)
+            _SNAPSHOT_ENTRIES.set(len(snap.routes), "routes")
+            _SNAPSHOT_ENTRIES.set(sum(len(vmap) for vmap in snap.vehicles.values()), "vehicles")
+            _SNAPSHOT_ENTRIES.set(len(snap.stop_syms), "stops")
+            _SNAPSHOT_ENTRIES.set(len(snap.journeys), "connections")
+        finally:
+            self._unpin(snap)
+
+    def _snapshot_payload(self, snap: _Snapshot) -> dict:
+        """snap's indexes with its version and freshness, for persist (snap must be pinned)."""
+        return {
+            "version": snap.version,
+            "freshAt": snap.fresh_at,
+            "columnar": snap.columns is not None,
+            "indexes": snap.indexes(),
+        }
+
+    def _snapshot_from(self, payload: Optional[dict], source: str) -> Optional[_Snapshot]:
+        """A _Snapshot holding payload's indexes, or None if payload is unusable here."""
+        columnar = self._front.columns is not None
+        if not payload or payload.get("columnar") != columnar:
+            return None
+        try:
+            snap = _Snapshot(columnar)
+            for name in _Snapshot.INDEXES:
+                setattr(snap, name, payload["indexes"][name])
+            snap.version = int(payload["version"])
+            snap.fresh_at = float(payload["freshAt"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        snap.source = source
+        return snap
+
+    def _install(self, snap: _Snapshot, raw: Optional[tuple]) -> None:
+        """
+        Publish a snapshot built elsewhere as it is. With raw trees, the other
+        copy is rebuilt from them by the next flush; without (a follower),
+        there is nothing to build from until the next snapshot arrives.
+        """
+        with self._write_lock:
+            with self._lock:
+                if raw is not None:
+                    self._raw_routes, self._raw_vehicles, self._raw_geo = (dict(t) for t in raw)
+                    self._pending.append(("all",))
+                else:
+                    self._raw_routes, self._raw_vehicles, self._raw_geo = {}, {}, {}
+                    self._pending = []
+                self._raw_fresh_at = snap.fresh_at
+            snap.version = max(snap.version, self._front.version + 1)
+            with self._readers:
+                self._front, self._back = snap, _Snapshot(snap.columns is not None)
+
+    # ---------- Snapshot file (warm start) ----------
+    def save_snapshot(self, path: Optional[str] = None) -> bool:
+        """
+        Write the published snapshot (raw trees plus built indexes, with its
+        version and freshness) to path, default SNAPSHOT_FILE. The snapshot
+        stays pinned while it is pickled, so the writer cannot recycle it.
+        """
+        path = path or self.snapshot_file
+        if not path:
+            return False
+        with self._lock:   # raw trees are copy-on-write below the top level
+            raw = (dict(self._raw_routes), dict(self._raw_vehicles), dict(self._raw_geo))
+        snap = self._pin()
+        try:
+            if not snap.version:
+                return False
+            with self._save_lock, snap.expire_lock:
+                persist.save_snapshot(path, dict(self._snapshot_payload(snap), raw=raw))
+                _SNAPSHOT_BYTES.set(os.path.getsize(path))
+        finally:
+            self._unpin(snap)
+        self._saved = (time.monotonic(), snap.version)
+        return True
+
+    def load_snapshot(self, path: Optional[str] = None) -> bool:
+        """
+        Publish the snapshot saved at path (default SNAPSHOT_FILE) as is, with
+        the version and age it was saved with; the other copy is rebuilt from
+        its raw trees by the next flush. False if there is no usable file.
+        """
+        path = path or self.snapshot_file
+        payload = persist.load_snapshot(path) if path else None
+        snap = self._snapshot_from(payload, "file")
+        if snap is None:
+            return False
+        try:
+            routes, vehicles, geo = payload["raw"]
+        except (KeyError, TypeError, ValueError):
+            return False
+        self._install(snap, (routes, vehicles, geo))
+        rids = set(routes) | set(vehicles)
+        self.route_meta.bump_many(rids)
+        self.versions.bump_many(rids)
+        self._wake.set()
+        return True
+
+    def _maybe_save(self) -> None:
+        saved_at, version = self._saved
+        if (self.snapshot_file and self._front.version != version and self._front.source is None
+                and time.monotonic() - saved_at >= self.save_interval):
+            try:
+                self.save_snapshot()
+            except Exception:
+                pass   # a full disk must not stop the refresher
+
+    # ---------- Shared snapshot (several worker processes) ----------
+    def _maybe_share(self) -> None:
+        """Publisher: hand a new snapshot to the other workers at most every share_interval, else a heartbeat."""
+        shared = self.shared
+        if shared is None or not shared.leading:
+            return
+        published_at, version = self._published
+        try:
+            if self._front.version == version or time.monotonic() - published_at < self.share_interval:
+                shared.touch(self._front.fresh_at)
+                return
+            # versions first: if a flush lands in between, followers see it again next time rather than never
+            meta, data = self.route_meta.as_dict(), self.versions.as_dict()
+            snap = self._pin()
+            try:
+                with snap.expire_lock:
+                    blob = persist.dumps(dict(self._snapshot_payload(snap), routeVersions={
+                        rid: (meta.get(rid, 0), data.get(rid, 0)) for rid in set(meta) | set(data)}))
+                shared.publish(blob, snap.fresh_at)
+                _SNAPSHOT_BYTES.set(len(blob))
+            finally:
+                self._unpin(snap)
+            self._published = (time.monotonic(), snap.version)
+        except Exception:
+            pass   # e.g. /dev/shm full: followers keep the last snapshot, whose age shows it
+
+    def _pull_shared(self) -> bool:
+        """Follower: install the publisher's newest snapshot if there is one; else just take its heartbeat."""
+        try:
+            hit = self.shared.fetch(persist.loads)
+            if hit is None:
+                generation, fresh_at = self.shared.read()
+                if generation and generation == self.shared.generation and self._front.source == "shared":
+                    self._front.fresh_at = max(self._front.fresh_at, fresh_at)
+                return False
+        except Exception:
+            return False
+        _, fresh_at, payload = hit
+        snap = self._snapshot_from(payload, "shared")
+        if snap is None:
+            return False
+        snap.fresh_at = max(snap.fresh_at, fresh_at)
+        seen = payload.get("routeVersions") or {}
+        old = self._shared_versions
+        self._install(snap, None)
+        self._shared_versions = seen
+        changed = {rid for rid in set(seen) | set(old) if seen.get(rid) != old.get(rid)}
+        meta = {rid for rid in changed if (seen.get(rid) or (0, 0))[0] != (old.get(rid) or (0, 0))[0]}
+        if meta:
+            self.route_meta.bump_many(meta)
+        if changed:
+            self.versions.bump_many(changed)
+        return True
+
+    def _follow(self, timeout: float) -> None:
+        """Wait up to timeout for the publisher's first snapshot; without one, load on our own meanwhile."""
+        deadline = time.monotonic() + timeout
+        while not self._pull_shared():
+            if time.monotonic() >= deadline:
+                if not self.load_snapshot():
+                    try:
+                        self.refresh_from_db(timeout)
+                    except Exception:
+                        pass
+                return
+            time.sleep(0.05)
+
+    # ---------- Background refresh / snapshot publishing ----------
+    def _start_refresher(self, connect_timeout: Optional[float] = None) -> None:
+        self._refresher_stop = stop = threading.Event()
+        self._refresher = threading.Thread(target=self._refresh_loop, args=(stop, connect_timeout),
+                                           name="snapshot-refresher", daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self, stop: threading.Event, connect_timeout: Optional[float] = None) -> None:
+        """
+        Publish listener changes as they arrive; without listeners, reload every
+        refresh_interval. Listeners that went quiet must pass a liveness check to
+        keep the snapshot current, else they are dropped for polling (and tried
+        again after max_age). With connect_timeout, first connect (after a warm start).
+        A follower only picks up shared snapshots until the publisher exits and
+        it can take over.
+        """
+        if self.shared is not None and not self.shared.leading:
+            while not self.shared.lead():
+                self._pull_shared()
+                if stop.wait(self.share_interval):
+                    return
+            connect_timeout = _fetch_timeout()
+        if connect_timeout is not None:
+            with self._sync_lock:   # requests keep serving the loaded snapshot meanwhile
+                try:
+                    self._connect(connect_timeout)
+                except Exception:
+                    pass   # Firebase unreachable: stay on the file, retry at the next poll
+        next_poll = time.monotonic() + self.refresh_interval
+        relisten_at = None   # after listeners went stale: when to try attaching them again
+        while not stop.is_set():
+            self._maybe_save()
+            self._maybe_share()
+            if self._listeners:
+                self._wake.wait(min(self.refresh_interval, self.max_age / 2, self._share_wait()))
+                self._wake.clear()
+                if stop.is_set():
+                    return
+                if self._flush() or time.time() - self._raw_fresh_at < min(self.refresh_interval, self.max_age / 2):
+                    continue
+                # quiet for a while: only a liveness check may keep the snapshot counted as current
+                if self._listeners_alive():
+                    with self._lock:
+                        self._raw_fresh_at = time.time()
+                    self._front.fresh_at = max(self._front.fresh_at, self._raw_fresh_at)
+                    continue
+                self._stop_listeners()   # poll from now on
+                next_poll = time.monotonic()
+                relisten_at = next_poll + self.max_age
+            if self._wake.is_set():   # e.g. a loaded snapshot file queued its rebuild
+                self._wake.clear()
+                self._flush()
+            if stop.wait(max(0.0, min(next_poll - time.monotonic(), self._share_wait()))):
+                return
+            if time.monotonic() < next_poll:
+                continue   # only woke to share
+            next_poll = time.monotonic() + self.refresh_interval
+            try:
+                if relisten_at is not None and time.monotonic() >= relisten_at:
+                    relisten_at = None
+                    with self._sync_lock:
+                        self._connect(_fetch_timeout())   # falls back to a reload if they still cannot attach
+                else:
+                    self.refresh_from_db()
+            except Exception:
+                pass   # keep serving the last snapshot; its age shows how stale it is
+
+    def _listeners_alive(self) -> bool:
+        """
+        Whether the listeners are still attached: each one's stream thread (where
+        the client exposes it) is running and Firebase answers a shallow read,
+        since a stream on a dropped connection can hang without failing.
+        """
+        for reg in self._listeners:
+            thread = getattr(reg, "_thread", None)
+            if thread is not None and not thread.is_alive():
+                return False
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="listener-probe")
+        try:
+            pool.submit(rtdb_ref("/routes").get, shallow=True).result(_fetch_timeout())
+            return True
+        except Exception:
+            return False
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _share_wait(self) -> float:
+        return self.share_interval if self.shared is not None else float("inf")
+
+    def _flush(self) -> bool:
+        """
+        Publish pending changes: apply them to the back snapshot, swap it in as
+        the one readers pin, wait until no reader still holds the old one, then
+        replay the same ops there so both copies stay level. Ops re-read the
+        raw trees, so replaying them later only brings that copy further
+        forward. False if nothing was pending.
+        """
+        with self._write_lock:
+            with self._lock:
+                ops = _compact(self._pending)
+                self._pending = []
+                if not ops:
+                    return False
+                back = self._back
+                routes, meta = self._touched(ops)
+                t = time.perf_counter()
+                self._apply_ops(back, ops)
+            t = _observe_phase("build", t)
+            back.version = self._front.version + 1
+            back.fresh_at = self._raw_fresh_at
+            with self._readers:
+                old, self._front, self._back = self._front, back, self._front
+                self._readers.wait_for(lambda: not old.readers)
+            t = _observe_phase("swap", t)
+            if meta:
+                self.route_meta.bump_many(meta)
+            if routes:
+                self.versions.bump_many(routes)
+            with self._lock:
+                self._apply_ops(old, ops)
+            _observe_phase("replay", t)
+        return True
+
+    def _touched(self, ops: List[tuple]) -> Tuple[set, set]:
+        """(routes whose data changes, routes whose entry changes) for a batch of ops."""
+        routes, meta = set(), set()
+        for op in ops:
+            if op[0] == "all":
+                meta |= set(self._raw_routes) | set(self._front.routes.keys())
+                routes |= meta | set(self._raw_vehicles) | set(self._front.route_vids)
+            elif op[0] == "route":
+                meta.add(op[1])
+                routes.add(op[1])
+            elif op[0] == "vehicle":
+                routes.add(op[1])
+        return routes, meta
+
+    def _apply_ops(self, snap: _Snapshot, ops: List[tuple]) -> None:
+        """Run index ops against snap (pinned for this thread), then settle it so reads never write."""
+        self._local.snap = snap
+        try:
+            for op in ops:
+                kind = op[0]
+                if kind == "all":
+                    self._rebuild_all()
+                elif kind == "route":
+                    self._rebuild_route(op[1])
+                elif kind == "vehicle":
+                    self._apply_vehicle(op[1], op[2], state_only=op[3])
+                elif op[1] is None:
+                    self._rebuild_geo()
+                else:
+                    self._apply_geo(op[1])
+            self.journeys.prepare()
+            if self.columns is not None:
+                self.columns.prepare()
+        finally:
+            self._local.snap = None
+
+    def _pin(self) -> _Snapshot:
+        with self._readers:
+            snap = self._front
+            snap.readers += 1
+        return snap
+
+    def _unpin(self, snap: _Snapshot) -> None:
+        with self._readers:
+            snap.readers -= 1
+            if not snap.readers:
+                self._readers.notify_all()
+
+    def _pinned(self) -> _Snapshot:
+        return getattr(self._local, "snap", None) or self._front
+
+    def _start_listeners(self, timeout: float) -> None:
+        self._listening = True
+        self._primed = {"routes": threading.Event(), "vehicles": threading.Event(),
+                        "stopsGeo": threading.Event()}
+        for name in self._primed:
+            reg = rtdb_ref(f"/{name}").listen(lambda ev, name=name: self._on_event(name, ev))
+            self._listeners.append(reg)
+        for name, ready in self._primed.items():
+            if not ready.wait(timeout):
+                raise TimeoutError(f"no initial data from /{name} listener")
+
+    def _on_event(self, tree_name: str, event) -> None:
+        """Apply one listener event ('put' or 'patch') to the raw tree and queue index ops for what it touched."""
+        parts = _split_path(event.path)
+        data = event.data
+        with self._lock:
+            self._raw_fresh_at = time.time()   # the stream is live, even if this event changes nothing
+            tree = {"routes": self._raw_routes, "vehicles": self._raw_vehicles}.get(tree_name, self._raw_geo)
+            # values we already hold (e.g. our own writes echoing back) queue nothing
+            if event.event_type == "patch" and isinstance(data, dict):
+                changed = []
+                for sub, value in data.items():
+                    sub_parts = parts + _split_path(sub)
+                    if not sub_parts or _get_in(tree, sub_parts) != value:
+                        if sub_parts:
+                            _set_in(tree, sub_parts, value)
+                        changed.append(sub_parts)
+            elif not parts:
+                tree.clear()
+                tree.update(data if isinstance(data, dict) else {})
+                changed = [[]]
+            elif _get_in(tree, parts) != data:
+                _set_in(tree, parts, data)
+                changed = [parts]
+            else:
+                changed = []
+
+            pending = self._pending
+            if tree_name == "stopsGeo":
+                if any(not c for c in changed):
+                    pending.append(("geo", None))
+                else:
+                    pending.extend(("geo", c[0]) for c in changed)
+            elif any(not c for c in changed):
+                pending.append(("all",))
+            else:
+                for c in changed:
+                    if tree_name == "vehicles" and len(c) >= 2 and c[0] in self._raw_routes:
+                        # a single vehicle changed: adjust its heap entries in place
+                        pending.append(("vehicle", c[0], c[1], len(c) == 3 and c[2] in _STATE_FIELDS))
+                    else:
+                        pending.append(("route", c[0]))
+        if changed:
+            self._wake.set()
+        ready = self._primed.get(tree_name)
+        if ready:
+            ready.set()
+
+    def _patch_vehicle(self, rid: str, vid: str, changes: dict, seen: dict, publish: bool = True) -> None:
+        """
+        Apply our own write to the local snapshot without waiting for the
+        listener. `seen` holds the values our transaction replaced: with
+        listeners attached a field is only patched while it still holds that
+        value, otherwise the listener has already delivered our write or a
+        newer one and patching would roll it back.
+        """
+        with self._lock:
+            v = (self._raw_vehicles.get(rid) or {}).get(vid)
+            if v is None:
+                return
+            fields = {f: value for f, value in changes.items()
+                      if not self._listening or v.get(f) == seen.get(f)}
+            if not fields:
+                return
+            for field, value in fields.items():
+                _set_in(self._raw_vehicles, [rid, vid, field], value)
+            self._pending.append(("vehicle", rid, vid, set(fields) <= _STATE_FIELDS))
+        if publish:
+            self._flush()
+
+    # ---------- Index building ----------
+    def _rebuild_all(self) -> None:
         self.routes = HashMap()
+        self.vehicles = HashMap()
+        self.route_syms = SymbolTable()
+        self.stop_syms = SymbolTable(_norm_stop)
+        self.arrivals = ArrivalIndex()
+        self.timelines = StopTimelines()
+        self.stop_index = StopIndex()
+        self.journeys = ConnectionScan()
+        if self.columns is not None:
+            self.columns = ScheduleColumns()
         self.route_alias = {}
         self.stop_alias = {}
-        for rid, r in routes.items():
+        self._route_vids = {}
+        for rid in set(self._raw_routes) | set(self._raw_vehicles):
+            self._rebuild_route(rid)
+        self._rebuild_geo()
+
+    def _rebuild_geo(self) -> None:
+        self.geo = GeoGrid()
+        for name in list(self._raw_geo):
+            self._apply_geo(name)
+
+    def _apply_geo(self, name: str) -> None:
+        """Re-index one /stopsGeo entry (keyed by stop name) under its stop id."""
+        sid = self.stop_syms.intern(name)
+        g = self._raw_geo.get(name)
+        try:
+            self.geo.put(sid, float(g["lat"]), float(g["lng"]))
+        except (TypeError, KeyError, ValueError):
+            self.geo.remove(sid)
+
+    def _rebuild_route(self, rid: str) -> None:
+        """Rebuild one route's lookup maps and vehicle map, then diff its arrival entries."""
+        r = self._raw_routes.get(rid)
+        if r is not None:
             self.routes.put(rid, r)
             self.route_alias[rid.lower()] = rid
             self.route_alias[rid.upper()] = rid
             stops = (r or {}).get("stops", []) or []
-            self.stop_alias[rid] = {_norm_stop(s): s for s in stops}
+            self.stop_alias[rid] = {self.stop_syms.intern(s): s for s in stops}
+            name = self.stop_syms.name
+            self.stop_index.set_route(self.route_syms.intern(rid),
+                                      {sid: (name(sid), s) for sid, s in self.stop_alias[rid].items()})
+        else:
+            self.routes.remove(rid)
+            for alias in (rid.lower(), rid.upper()):
+                if self.route_alias.get(alias) == rid:
+                    self.route_alias.pop(alias)
+            self.stop_alias.pop(rid, None)
+            ri = self.route_syms.id(rid)
+            if ri is not None:
+                self.stop_index.drop(ri)
 
-        # vehicles
-        vehicles_tree = rtdb_ref("/vehicles").get() or {}
-        self.vehicles = HashMap()
-        for rid, vdict in (vehicles_tree or {}).items():
-            inner = HashMap()
-            for vid, v in (vdict or {}).items():
-                inner.put(vid, v)
-            self.vehicles.put(rid, inner)
-
-        # min-heaps per stop for fastest lookup
-        self.stop_heaps = HashMap()
-        now = _now_utc()
-        for rid in self.routes.keys():
-            vmap: HashMap = self.vehicles.get(rid, HashMap())
-            for vid, v in vmap.items():
-                delay = int(v.get("delayMinutes", 0))
-                idx = int(v.get("currentStopIndex", 0))
-                for i, item in enumerate(v.get("schedule", [])):
-                    stop = item.get("stop")
-                    t = int(item.get("timeEpoch", 0))
-                    if stop and i >= idx:
-                        eta_dt = datetime.fromtimestamp(t, tz=timezone.utc) + timedelta(minutes=delay)
-                        if eta_dt >= now:
-                            key = _norm_stop(stop)
-                            heap: MinHeap = self.stop_heaps.get(key)
-                            if not heap:
-                                heap = MinHeap()
-                                self.stop_heaps.put(key, heap)
-                            heap.insert((eta_dt, rid, vid))
+        old_vids = self._route_vids.get(rid, set())
+        vdict = self._raw_vehicles.get(rid)
+        if vdict is not None:
+            self.vehicles.put(rid, HashMap())
+        else:
+            self.vehicles.remove(rid)
+        for vid in set(old_vids) | set(vdict or {}):
+            self._apply_vehicle(rid, vid)
+
+    def _apply_vehicle(self, rid: str, vid: str, state_only: bool = False) -> None:
+        """
+        Bring one vehicle's map entry and its arrival entries in line with the raw
+        snapshot: only entries whose ETA changed, appeared or disappeared touch a heap.
+        state_only means just delay / current index changed, which the columnar
+        store takes as an O(1) write.
+        """
+        v = (self._raw_vehicles.get(rid) or {}).get(vid)
+        vmap: HashMap = self.vehicles.get(rid)
+        if vmap is None and v:
+            vmap = HashMap()
+            self.vehicles.put(rid, vmap)
+        if vmap is not None:
+            if v:
+                vmap.put(vid, v)
+            else:
+                vmap.remove(vid)
+
+        self._apply_connections(rid, vid, v)
+        if self.columns is not None:
+            self._apply_vehicle_columns(rid, vid, v, state_only)
+            return
+
+        # per-stop heap entries and per-(route, stop) timeline rows (only for routes we know about)
+        new: dict = {}
+        rows: Dict[Tuple[str, str], list] = {}
+        if v and rid in self._raw_routes:
+            ri = self.route_syms.intern(rid)
+            now = _now_utc()
+            delay = int(v.get("delayMinutes", 0))
+            idx = int(v.get("currentStopIndex", 0))
+            intern = self.stop_syms.intern
+            for i, item in enumerate(v.get("schedule", []) or []):
+                if not item or i < idx:
+                    continue
+                stop = item.get("stop")
+                t = int(item.get("timeEpoch", 0))
+                if stop:
+                    sid = intern(stop)
+                    eta = t + delay * 60
+                    rows.setdefault((ri, sid), []).append((eta, vid, i))
+                    eta_dt = datetime.fromtimestamp(t, tz=timezone.utc) + timedelta(minutes=delay)
+                    if eta_dt >= now:
+                        new[(ri, vid, i)] = (sid, (eta_dt, ri, vid))
+
+        owner = (self.route_syms.id(rid), vid)
+        self.timelines.set_entries(owner, rows)
+        self.arrivals.set_entries(owner, new)
+        vids = self._route_vids.setdefault(rid, set())
+        if new or rows:
+            vids.add(vid)
+        else:
+            vids.discard(vid)
+            if not vids:
+                self._route_vids.pop(rid, None)
+
+    def _apply_connections(self, rid: str, vid: str, v: Optional[dict]) -> None:
+        """Journey-planner hops of one vehicle: consecutive stops it has not left yet, delay applied."""
+        ri = self.route_syms.id(rid)
+        conns = []
+        if v and rid in self._raw_routes:
+            ri = self.route_syms.intern(rid)
+            delay = int(v.get("delayMinutes", 0)) * 60
+            sched = v.get("schedule", []) or []
+            intern = self.stop_syms.intern
+            prev = None
+            for i in range(max(int(v.get("currentStopIndex", 0)), 0), len(sched)):
+                item = sched[i]
+                if not item or not item.get("stop"):
+                    prev = None
+                    continue
+                cur = (int(item.get("timeEpoch", 0)) + delay, intern(item["stop"]), i)
+                if prev and cur[0] >= prev[0]:
+                    conns.append((prev[0], cur[0], prev[1], cur[1], prev[2]))
+                prev = cur
+        if ri is not None:
+            self.journeys.set_entries((rid, vid), conns)   # names, not ids: they order ties
+
+    def _apply_vehicle_columns(self, rid: str, vid: str, v: Optional[dict], state_only: bool) -> None:
+        cols = self.columns
+        vids = self._route_vids.setdefault(rid, set())
+        if not v or rid not in self._raw_routes:
+            ri = self.route_syms.id(rid)
+            if ri is not None:
+                cols.drop(ri, vid)
+            vids.discard(vid)
+            if not vids:
+                self._route_vids.pop(rid, None)
+            return
+        ri = self.route_syms.intern(rid)
+        delay = int(v.get("delayMinutes", 0))
+        idx = int(v.get("currentStopIndex", 0))
+        if state_only and cols.set_state(ri, vid, delay, idx):
+            return
+        sched = [(i, item) for i, item in enumerate(v.get("schedule", []) or []) if item and item.get("stop")]
+        intern = self.stop_syms.intern
+        cols.set_vehicle(ri, vid, delay, idx,
+                         [intern(item["stop"]) for _, item in sched],
+                         [int(item.get("timeEpoch", 0)) for _, item in sched],
+                         [i for i, _ in sched])
+        vids.add(vid)
 
     # ---------- Helpers ----------
     def _resolve_route(self, route_id: str) -> Optional[str]:
@@ -84,208 +1056,464 @@ class TransportManagerFB:
         if not rid:
             return None
         alias_map = self.stop_alias.get(rid, {})
-        return alias_map.get(_norm_stop(stop_name))
+        return alias_map.get(self.stop_syms.id(stop_name))
+
+    def _stop_key(self, rid: str, stop_name: str) -> Optional[Tuple[int, int]]:
+        """(route id, stop id) for a resolved route and a stop on it, else None."""
+        sid = self.stop_syms.id(stop_name) if stop_name else None
+        if sid is None or sid not in self.stop_alias.get(rid, {}):
+            return None
+        ri = self.route_syms.id(rid)
+        return None if ri is None else (ri, sid)
 
     def _resolve_stop_any(self, stop_name: str) -> Optional[str]:
         if not stop_name:
             return None
-        ns = _norm_stop(stop_name)
-        for _, amap in self.stop_alias.items():
-            canon = amap.get(ns)
-            if canon:
-                return canon
-        return None
+        sid = self.stop_syms.id(stop_name)
+        return None if sid is None else self.stop_index.canonical(sid)
 
     # ---------- small utility: push with de-dupe ----------
-    def _push_recent(self, route_id: Optional[str], stop_name: Optional[str]) -> None:
-        """Push a (route_id, stop_name) if it's not identical to the last entry."""
-        last = self.recent_searches.top()
-        pair = (route_id or "", stop_name or "")
-        if last != pair:
-            self.recent_searches.push(pair)
+    def _push_recent(self, route_id: Optional[str], stop_name: Optional[str], session_id: str = "") -> None:
+        """Push a (route_id, stop_name) if it's not identical to the session's last entry."""
+        self.recent_searches.push(session_id, (route_id or "", stop_name or ""))
 
     # ---------- Queries ----------
+    @_reads
     def get_routes(self) -> Dict[str, dict]:
         out = {}
         for rid, r in self.routes.items():
             out[rid] = r
         return out
 
-    def get_next_arrivals(self, route_id: str, stop_name: str, count: int = 3) -> List[Tuple[str, str]]:
-        rid = self._resolve_route(route_id)
-        canon_stop = self._resolve_stop(route_id, stop_name)
-
+    @_reads
+    def get_next_arrivals(self, route_id: str, stop_name: str, count: int = 3,
+                          session_id: str = "") -> List[Tuple[str, str]]:
         # record recent search even if it turns out invalid (helps users correct quickly)
-        self._push_recent(route_id, stop_name)
+        self._push_recent(route_id, stop_name, session_id)
+        return self._next_arrivals(route_id, stop_name, count)
 
-        if not rid or not canon_stop:
+    @_reads
+    def _next_arrivals(self, route_id: str, stop_name: str, count: int) -> List[Tuple[str, str]]:
+        rid = self._resolve_route(route_id)
+        key = self._stop_key(rid, stop_name) if rid else None
+        if not key:
             return []
 
-        vmap: HashMap = self.vehicles.get(rid, HashMap())
-        options = []
-        now = _now_utc()
-        for vid, v in vmap.items():
-            delay = int(v.get("delayMinutes", 0))
-            idx = int(v.get("currentStopIndex", 0))
-            q = Queue()
-            for i, item in enumerate(v.get("schedule", [])):
-                if i >= idx:
-                    q.enqueue(item)
-            while not q.is_empty():
-                item = q.dequeue()
-                if _norm_stop(item.get("stop")) == _norm_stop(canon_stop):
-                    eta = datetime.fromtimestamp(int(item["timeEpoch"]), tz=timezone.utc) + timedelta(minutes=delay)
-                    if eta >= now:
-                        options.append((eta, vid))
-                    break
-        options.sort(key=lambda x: x[0])
-        return [(_fmt_hhmm(dt), vid) for dt, vid in options[:count]]
+        now = int(_now_utc().timestamp())
+        if self.columns is not None:
+            hits = self.columns.next_k(key[0], key[1], now, count)
+        else:
+            hits = self.timelines.next_k(key, now, count)
+        return [(_fmt_hhmm(datetime.fromtimestamp(eta, tz=timezone.utc)), vid) for eta, vid in hits]
 
+    @_reads
     def get_next_arrival_epoch(self, route_id: str, stop_name: str) -> Optional[Tuple[int, str]]:
         rid = self._resolve_route(route_id)
         if not rid:
             return None
-        canon_stop = self._resolve_stop(route_id, stop_name)
-        if not canon_stop:
+        key = self._stop_key(rid, stop_name)
+        if not key:
             return None
 
-        vmap: HashMap = self.vehicles.get(rid, HashMap())
         now = int(datetime.now(timezone.utc).timestamp())
-        best_t, best_vid = None, None
+        if self.columns is not None:
+            hits = self.columns.next_k(key[0], key[1], now, 1)
+            return hits[0] if hits else None
+        return self.timelines.first(key, now)
 
+    @_reads
+    def get_earliest_arrival_at_stop(self, stop_name: str, session_id: str = "") -> Optional[Tuple[str, str, str]]:
+        sid = self.stop_syms.id(stop_name) if stop_name else None
+        if sid is None:
+            return None
+        if self.columns is not None:
+            earliest = self.columns.earliest(sid, int(_now_utc().timestamp()))
+            if not earliest:
+                return None
+            eta, ri, vid = earliest
+            eta_dt = datetime.fromtimestamp(eta, tz=timezone.utc)
+        else:
+            with self._pinned().expire_lock:
+                earliest = self.arrivals.earliest(sid, _now_utc())
+            if not earliest:
+                return None
+            eta_dt, ri, vid = earliest
+        rid = self.route_syms.name(ri)
+
+        # Record the (route, stop) that produced the earliest result
+        self._push_recent(rid, stop_name, session_id)
+
+        return (_fmt_hhmm(eta_dt), rid, vid)
+
+    @_reads
+    def search_stops(self, query: str, limit: int = 10) -> List[dict]:
+        """Ranked completions for a typed stop prefix, each with the routes serving it."""
+        hits = self.stop_index.search(_norm_stop(query), limit)
+        name = self.route_syms.name
+        return [{"stop": canon, "routes": sorted(name(ri) for ri in routes)} for _, canon, routes in hits]
+
+    @_reads
+    def plan_journey(self, from_stop: str, to_stop: str,
+                     depart_after: Optional[int] = None) -> Optional[dict]:
+        """
+        Earliest-arrival itinerary between two stops (any routes, with
+        transfers), leaving at or after depart_after (epoch, default now).
+        None if either stop is unknown or no connection gets there.
+        """
+        src = self.stop_syms.id(from_stop) if from_stop else None
+        dst = self.stop_syms.id(to_stop) if to_stop else None
+        if src is None or dst is None:
+            return None
+        if depart_after is None:
+            depart_after = int(_now_utc().timestamp())
+
+        def stop(sid: int) -> str:
+            return self.stop_index.canonical(sid) or self.stop_syms.name(sid)
+
+        legs = self.journeys.earliest_arrival(src, dst, depart_after)
+        if legs is None:
+            return None
+        out = []
+        for (rid, vid), hops in legs:
+            first, last = hops[0], hops[-1]
+            out.append({
+                "routeId": rid,
+                "vehicleId": vid,
+                "from": stop(first[2]),
+                "to": stop(last[3]),
+                "departEpoch": first[0],
+                "arriveEpoch": last[1],
+                "depart": _fmt_hhmm(datetime.fromtimestamp(first[0], tz=timezone.utc)),
+                "arrive": _fmt_hhmm(datetime.fromtimestamp(last[1], tz=timezone.utc)),
+                "stops": [stop(h[2]) for h in hops] + [stop(last[3])],
+            })
+        return {
+            "from": stop(src),
+            "to": stop(dst),
+            "departEpoch": out[0]["departEpoch"] if out else depart_after,
+            "arriveEpoch": out[-1]["arriveEpoch"] if out else depart_after,
+            "transfers": max(len(out) - 1, 0),
+            "legs": out,
+        }
+
+    @_reads
+    def get_vehicle_status(self, route_id: str) -> Dict[str, dict]:
+        """{vid: {delayMinutes, currentStopIndex}} for a route (empty if unknown)."""
+        vmap = self.vehicles.get(route_id)
+        if not vmap:
+            return {}
+        out = {}
         for vid, v in vmap.items():
-            delay_sec = int(v.get("delayMinutes", 0)) * 60
-            cur_idx = int(v.get("currentStopIndex", 0))
-            for idx, s in enumerate(v.get("schedule", [])):
-                if idx < cur_idx:
-                    continue
-                if _norm_stop(s.get("stop", "")) != _norm_stop(canon_stop):
-                    continue
-                t = int(s.get("timeEpoch", 0)) + delay_sec
-                if t >= now and (best_t is None or t < best_t):
-                    best_t, best_vid = t, vid
+            out[vid] = {
+                "delayMinutes": int(v.get("delayMinutes", 0)),
+                "currentStopIndex": int(v.get("currentStopIndex", 0))
+            }
+        return out
 
-        if best_t is None:
+    # ---------- Live route streams ----------
+    @_reads
+    def subscribe_route(self, route_id: str, stop_name: str = "") -> Optional[Subscription]:
+        """
+        Subscribe to pushes of a route's arrivals (at stop_name, if given) and
+        vehicle status; None if the route is unknown. Every subscriber of the
+        same (route, stop) shares one render per change.
+        """
+        rid = self._resolve_route(route_id)
+        if not rid:
             return None
-        return best_t, best_vid
+        canon = self._resolve_stop(rid, stop_name) if stop_name else None
+        return self.route_streams.subscribe((rid, canon or ""))
+
+    def unsubscribe_route(self, sub: Subscription) -> None:
+        self.route_streams.unsubscribe(sub)
 
-    def get_earliest_arrival_at_stop(self, stop_name: str) -> Optional[Tuple[str, str, str]]:
-        key = _norm_stop(stop_name)
-        heap: MinHeap = self.stop_heaps.get(key)
-        if not heap or heap.is_empty():
+    def _render_route_stream(self, key: Tuple[str, str]) -> dict:
+        return self._route_view(key[0], key[1], 5)
+
+    @_reads
+    def _route_view(self, rid: str, stop: str, count: int) -> dict:
+        """Arrivals at stop and vehicle status of a resolved route, from one snapshot."""
+        return {
+            "routeId": rid,
+            "stopName": stop,
+            "version": self.versions.get(rid),
+            "arrivals": self._next_arrivals(rid, stop, count) if stop else [],
+            "vehicles": self.get_vehicle_status(rid),
+        }
+
+    # ---------- Cache validators ----------
+    def route_dashboard_etag(self, route_id: str, stop_name: str = "") -> Optional[str]:
+        """
+        Validator for get_route_dashboard(): the route's snapshot version, its
+        report ring version and the soonest ETA shown (the list only rolls over
+        when that one passes). None if the route is unknown.
+        """
+        state = self._dashboard_state(route_id, stop_name)
+        if state is None:
             return None
-        eta_dt, rid, vid = heap.peek_min()
+        rid, version, nxt = state
+        # the report ring may refill from Firebase: read it with no snapshot pinned
+        return f"{self.instance_id}-{version}-{self.reports.version(rid)}-{nxt}"
 
-        # Record the (route, stop) that produced the earliest result
-        self._push_recent(rid, stop_name)
+    @_reads
+    def _dashboard_state(self, route_id: str, stop_name: str) -> Optional[Tuple[str, int, int]]:
+        """(route id, its version, soonest ETA shown or 0) from one snapshot; None if the route is unknown."""
+        rid = self._resolve_route(route_id)
+        if not rid:
+            return None
+        nxt = self.get_next_arrival_epoch(rid, stop_name) if stop_name else None
+        return rid, self.versions.get(rid), nxt[0] if nxt else 0
 
-        return (_fmt_hhmm(eta_dt), rid, vid)
+    def stops_etag(self, route_id: str) -> str:
+        return f"{self.instance_id}-{self.route_meta.get(route_id)}"
 
-    def get_recent_searches(self):
+    def routes_etag(self) -> str:
+        return f"{self.instance_id}-{self.route_meta.clock}"
+
+    def get_route_dashboard(self, route_id: str, stop_name: str = "", count: int = 5,
+                            reports: int = 5) -> Optional[dict]:
+        """Arrivals at stop_name, vehicle status and newest reports of a route in one dict."""
+        rid = self._lookup_route(route_id)
+        if not rid:
+            return None
+        view = self._route_view(rid, stop_name, count)
+        view["reports"] = self.reports.recent(rid, reports)   # after the view's pin is released
+        return view
+
+    def get_recent_searches(self, session_id: str = ""):
         # return newest first
-        return list(reversed(self.recent_searches.to_list()))
+        return self.recent_searches.items(session_id)
 
-    def clear_recent_searches(self):
-        """Reset the recent searches stack."""
-        self.recent_searches = Stack(maxlen=20)
+    def clear_recent_searches(self, session_id: str = ""):
+        """Reset this session's recent searches."""
+        self.recent_searches.clear(session_id)
 
     # ---------- Mutations ----------
     def submit_report(self, route_id: str, vehicle_id: Optional[str], report_type: str,
                       severity: int, message: str, stop_name: Optional[str] = None) -> bool:
-        import time as _time
-        rid = self._resolve_route(route_id)
+        rid, stop = self._resolve_report(route_id, stop_name)
         if not rid:
             return False
 
         pref = rtdb_ref(f"/reports/{rid}").push()
-        pref.set({
+        report = {
             "reportId": pref.key,
-            "timestampEpoch": int(_time.time()),
+            "timestampEpoch": int(time.time()),
             "routeId": rid,
             "vehicleId": vehicle_id,
             "type": report_type,
             "severity": int(severity),
             "message": message,
-            "stop": self._resolve_stop(rid, stop_name) if stop_name else None
-        })
+            "stop": stop
+        }
+        pref.set(report)
+        self.reports.add(rid, report)
 
-        vref = rtdb_ref(f"/vehicles/{rid}")
-        vdict = vref.get() or {}
+        # vehicle ids come from the listener-kept snapshot; only the delay write goes out
+        vdict = self._raw_vehicles.get(rid)
+        if vdict is None and not self._listeners:
+            vdict = rtdb_ref(f"/vehicles/{rid}").get(shallow=True)
         if not vdict:
-            self.refresh_from_db()
             return True
 
         if vehicle_id and vehicle_id not in vdict:
-            self.refresh_from_db()
             return False
 
-        targets = [vehicle_id] if vehicle_id else list(vdict.keys())
-
         if report_type == "delay":
             add = min(5 * max(int(severity), 1), 50)
-            for vid in targets:
-                cur = int((vdict[vid] or {}).get("delayMinutes", 0))
-                vref.child(vid).update({"delayMinutes": cur + add})
         elif report_type == "breakdown":
-            for vid in targets:
-                cur = int((vdict[vid] or {}).get("delayMinutes", 0))
-                vref.child(vid).update({"delayMinutes": cur + 60})
+            add = 60
+        else:
+            return True
 
-        self.refresh_from_db()
+        if vehicle_id:
+            vids = [vehicle_id]
+        else:
+            with self._lock:   # the listener may be changing the held tree
+                vids = [vid for vid, v in vdict.items() if isinstance(v, dict) or v is True]   # True: shallow get
+        if not vids:
+            return True
+        with self._lock:
+            held = self._raw_vehicles.get(rid) or {}
+            seen = {vid: (held.get(vid) if isinstance(held.get(vid), dict) else {}).get("delayMinutes")
+                    for vid in vids}
+        # one atomic multi-path write; the server adds to each leaf, so racing reports are never lost
+        try:
+            rtdb_ref(f"/vehicles/{rid}").update(
+                {f"{vid}/delayMinutes": {".sv": {"increment": add}} for vid in vids})
+        except Exception:
+            return False   # nothing was applied; the report itself is stored
+        for vid in vids:
+            self._patch_vehicle(rid, vid, {"delayMinutes": int(seen[vid] or 0) + add},
+                                {"delayMinutes": seen[vid]}, publish=False)
+        self._flush()
         return True
 
-    def record_departure(self, route_id: str, vehicle_id: str, stop_name: str) -> bool:
+    @_reads
+    def _lookup_route(self, route_id: str) -> Optional[str]:
+        """_resolve_route against one pinned snapshot, for callers that go on to do I/O unpinned."""
+        return self._resolve_route(route_id)
+
+    @_reads
+    def _resolve_report(self, route_id: str, stop_name: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        """Canonical route and stop of a report, from one snapshot (released before any write flushes)."""
         rid = self._resolve_route(route_id)
+        return rid, (self._resolve_stop(rid, stop_name) if rid and stop_name else None)
+
+    def record_departure(self, route_id: str, vehicle_id: str, stop_name: str) -> bool:
+        rid = self._lookup_route(route_id)
         if not rid:
             return False
-        vref = rtdb_ref(f"/vehicles/{rid}/{vehicle_id}")
-        v = vref.get()
+        return self._depart(rid, vehicle_id, [stop_name])[0]
+
+    def record_departures(self, departures: List[dict]) -> List[bool]:
+        """
+        Bulk record_departure for feeds: [{route_id, vehicle_id, stop_name}, ...].
+        Departures of the same vehicle go through one transaction, in order;
+        different vehicles are written concurrently. Returns one bool per item
+        (False for one missing a field or giving a non-string).
+        """
+        results = [False] * len(departures)
+        groups = self._departure_groups(departures)
+        if not groups:
+            return results
+
+        def run(key):
+            stops = [departures[i].get("stop_name") for i in groups[key]]
+            return key, self._depart(key[0], key[1], stops)
+
+        with ThreadPoolExecutor(max_workers=min(8, len(groups))) as pool:
+            for key, oks in pool.map(run, groups):
+                for i, ok in zip(groups[key], oks):
+                    results[i] = ok
+        return results
+
+    @_reads
+    def _departure_groups(self, departures: List[dict]) -> Dict[Tuple[str, str], List[int]]:
+        """(route id, vehicle id) -> indexes of its well-formed items, routes resolved in one snapshot."""
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        for i, d in enumerate(departures):
+            if not isinstance(d, dict):
+                continue
+            route_id, vid, stop = d.get("route_id"), d.get("vehicle_id"), d.get("stop_name")
+            if not (isinstance(route_id, str) and isinstance(vid, str) and isinstance(stop, str)):
+                continue   # malformed feed item: stays False
+            rid = self._resolve_route(route_id)
+            if rid and vid:
+                groups.setdefault((rid, vid), []).append(i)
+        return groups
+
+    def _depart(self, rid: str, vid: str, stops: List[str]) -> List[bool]:
+        """
+        Advance a vehicle's currentStopIndex past each stop in turn with a
+        compare-and-set transaction on that one leaf, so concurrent taps never
+        lose an update; then re-index only that vehicle locally. All False if
+        the read or the transaction fails (nothing of this vehicle was written).
+        """
+        v = (self._raw_vehicles.get(rid) or {}).get(vid)
+        if v is None and not self._listeners:
+            try:
+                v = rtdb_ref(f"/vehicles/{rid}/{vid}").get()
+            except Exception:
+                return [False] * len(stops)
         if not v:
-            return False
-        idx = int(v.get("currentStopIndex", 0))
-        sched = v.get("schedule", [])
-
-        target_norm = _norm_stop(stop_name)
-        if 0 <= idx < len(sched):
-            cur_norm = _norm_stop(sched[idx].get("stop"))
-            if cur_norm == target_norm:
-                vref.update({"currentStopIndex": idx + 1})
-                self.refresh_from_db()
-                return True
-            if idx + 1 < len(sched) and _norm_stop(sched[idx + 1].get("stop")) == target_norm:
-                vref.update({"currentStopIndex": idx + 2})
-                self.refresh_from_db()
-                return True
-
-        if idx < len(sched):
-            vref.update({"currentStopIndex": min(idx + 1, len(sched))})
-            self.refresh_from_db()
-            return True
-        return False
+            return [False] * len(stops)
+        sched_ids, targets = self._departure_stops(v.get("schedule", []) or [], stops)
+        oks: List[bool] = []
+        seen = {}
+
+        def advance(cur):
+            oks.clear()   # the update function reruns if another writer got in first
+            seen["currentStopIndex"] = cur
+            idx = int(cur or 0)
+            for target in targets:
+                new_idx = self._departure_index(sched_ids, idx, target)
+                oks.append(new_idx is not None)
+                if new_idx is not None:
+                    idx = new_idx
+            if not any(oks):
+                raise _NoAdvance()
+            return idx
+
+        try:
+            new_idx = rtdb_ref(f"/vehicles/{rid}/{vid}/currentStopIndex").transaction(advance)
+        except _NoAdvance:
+            return [False] * len(stops)
+        except Exception:
+            return [False] * len(stops)   # aborted or unreachable; other vehicles' groups carry on
+        self._patch_vehicle(rid, vid, {"currentStopIndex": new_idx}, seen)
+        return oks
+
+    @_reads
+    def _departure_stops(self, sched: list, stops: List[str]) -> Tuple[list, list]:
+        """Stop ids of a schedule and of the stops departed, from one snapshot (the transaction may rerun)."""
+        stop_id = self.stop_syms.id
+        return ([stop_id((entry or {}).get("stop") or "") for entry in sched],
+                [stop_id(stop or "") for stop in stops])
+
+    def _departure_index(self, sched_ids: list, idx: int, target: Optional[int]) -> Optional[int]:
+        """New currentStopIndex after departing stop id target from idx, or None if already at the end."""
+        new_idx = None
+        if 0 <= idx < len(sched_ids) and target is not None:
+            if sched_ids[idx] == target:
+                new_idx = idx + 1
+            elif idx + 1 < len(sched_ids) and sched_ids[idx + 1] == target:
+                new_idx = idx + 2
+
+        if new_idx is None and idx < len(sched_ids):
+            new_idx = min(idx + 1, len(sched_ids))
+        return new_idx
 
     def get_recent_reports(self, route_id: str, limit: int = 100):
-        """Return recent report dicts, defensively handling bad shapes."""
-        rid = self._resolve_route(route_id)
+        """Return recent report dicts (newest first) from the per-route report ring."""
+        rid = self._lookup_route(route_id)
         if not rid:
             return []
-        data = rtdb_ref(f"/reports/{rid}").get() or {}
+        try:
+            lim = max(0, int(limit or 0))
+        except Exception:
+            lim = 100
+        return self.reports.recent(rid, lim)
+
+    def _fetch_reports(self, rid: str, n: int) -> List[dict]:
+        """Newest n reports of a route via an ordered, limited query, defensively handling bad shapes."""
+        ref = rtdb_ref(f"/reports/{rid}")
+        try:
+            data = ref.order_by_child("timestampEpoch").limit_to_last(n).get() or {}
+        except Exception:
+            # e.g. the database has no ".indexOn": "timestampEpoch" rule for /reports/$rid
+            data = ref.get() or {}
         items = []
         if isinstance(data, dict):
             items = [v for v in data.values() if isinstance(v, dict)]
         elif isinstance(data, list):
             items = [v for v in data if isinstance(v, dict)]
-        items.sort(key=lambda x: int(x.get("timestampEpoch", 0)), reverse=True)
-        try:
-            lim = max(0, int(limit or 0))
-        except Exception:
-            lim = 100
-        return items[:lim]
+        items.sort(key=lambda x: int(x.get("timestampEpoch", 0)))
+        return items[-n:]
 
     # (Kept for data access; UI may still call this)
+    @_reads
     def get_stop_geo(self, stop_name: str):
-        canon = self._resolve_stop_any(stop_name) or stop_name
-        data = rtdb_ref(f"/stopsGeo/{canon}").get()
-        if not data:
-            data = rtdb_ref("/stopsGeo").get() or {}
-            data = data.get(canon) or data.get(stop_name) or data.get(stop_name.strip().title())
-        return data
+        """{lat, lng} of a stop from the in-memory snapshot (any spelling of its name)."""
+        sid = self.stop_syms.id(stop_name) if stop_name else None
+        point = self.geo.get(sid) if sid is not None else None
+        if not point:
+            return None
+        return {"lat": point[0], "lng": point[1]}
+
+    @_reads
+    def get_nearby_stops(self, lat: float, lng: float, radius_m: float = 500,
+                         k: int = 10) -> List[dict]:
+        """Up to k stops within radius_m metres of (lat, lng), closest first, with their routes."""
+        out = []
+        name = self.route_syms.name
+        for dist, sid in self.geo.nearby(lat, lng, radius_m, k):
+            plat, plng = self.geo.get(sid)
+            out.append({
+                "stop": self.stop_index.canonical(sid) or self.stop_syms.name(sid).title(),
+                "lat": plat,
+                "lng": plng,
+                "distanceM": round(dist, 1),
+                "routes": sorted(name(ri) for ri in self.stop_index.routes(sid)),
+            })
+        return out
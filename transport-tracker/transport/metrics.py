@@ -0,0 +1,152 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; spans a cached lookup up to a slow full reload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic total per label set."""
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in values]
+
+
+class Gauge(_Metric):
+    """Current value per label set, set by whoever owns the quantity (e.g. just before a scrape)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, *labels) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in values]
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram per label set. observe() is one bisect and two
+    additions under a lock; buckets are only made cumulative when rendered.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, list] = {}   # labels -> [per-bucket counts (last = +Inf), sum]
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(counts), total)) for k, (counts, total) in self._series.items())
+        out = []
+        for key, (counts, total) in series:
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                le = 'le="%s"' % _num(bound)
+                out.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {running}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, key)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.label_names, key)} {running}")
+        return out
+
+
+class Registry:
+    """Named metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, doc: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter, name, doc, labels)
+
+    def gauge(self, name: str, doc: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge, name, doc, labels)
+
+    def histogram(self, name: str, doc: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram, name, doc, labels, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
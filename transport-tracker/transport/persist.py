@@ -0,0 +1,91 @@
+import os
+import pickle
+import struct
+import tempfile
+from typing import List, Optional
+
+# bump whenever a pickled index class changes shape; older files are then ignored
+SNAPSHOT_FORMAT = 4
+_MAGIC = b"TTSNAP%d\n" % SNAPSHOT_FORMAT
+# after the magic: pickle length, buffer count; then (offset, length) per out-of-band buffer
+_COUNTS = struct.Struct("<QQ")
+_EXTENT = struct.Struct("<QQ")
+_ALIGN = 64
+
+
+def dumps(payload: dict) -> bytes:
+    """
+    payload (plain data and our index objects) as one pickle behind a format
+    header. Large contiguous arrays (numpy) are not copied into the pickle
+    stream but laid out after it, aligned, so loads() can view them in place.
+    """
+    buffers: List[pickle.PickleBuffer] = []
+    stream = pickle.dumps(payload, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+    head = len(_MAGIC) + _COUNTS.size + _EXTENT.size * len(raws)
+    extents, offset = [], head + len(stream)
+    for raw in raws:
+        offset += -offset % _ALIGN
+        extents.append((offset, raw.nbytes))
+        offset += raw.nbytes
+    out = bytearray(offset)
+    out[:len(_MAGIC)] = _MAGIC
+    _COUNTS.pack_into(out, len(_MAGIC), len(stream), len(raws))
+    for i, extent in enumerate(extents):
+        _EXTENT.pack_into(out, len(_MAGIC) + _COUNTS.size + i * _EXTENT.size, *extent)
+    out[head:head + len(stream)] = stream
+    for (start, size), raw in zip(extents, raws):
+        out[start:start + size] = raw
+    return bytes(out)
+
+
+def loads(data) -> Optional[dict]:
+    """
+    The payload in data (bytes or a buffer) as written by dumps(), or None if
+    it cannot be used (another format, truncated, classes changed). Arrays
+    come back as read-only views of data, which they keep alive. Only load
+    data this app wrote itself: unpickling runs code.
+    """
+    view = memoryview(data)
+    if bytes(view[:len(_MAGIC)]) != _MAGIC:
+        return None
+    try:
+        size, count = _COUNTS.unpack_from(view, len(_MAGIC))
+        head = len(_MAGIC) + _COUNTS.size + _EXTENT.size * count
+        buffers = []
+        for i in range(count):
+            start, length = _EXTENT.unpack_from(view, len(_MAGIC) + _COUNTS.size + i * _EXTENT.size)
+            if start + length > len(view):
+                return None
+            buffers.append(view[start:start + length].toreadonly())
+        payload = pickle.loads(view[head:head + size], buffers=buffers)
+    except Exception:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def save_snapshot(path: str, payload: dict) -> None:
+    """
+    Write dumps(payload) to path. The file is written next to path and
+    renamed over it, so a crash mid-write never leaves a torn snapshot behind.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dumps(payload))
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load_snapshot(path: str) -> Optional[dict]:
+    """The payload saved at path, or None if there is none or it cannot be used (see loads)."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return loads(data)
@@ -0,0 +1,255 @@
+"""
+Opt-in sampling profiler for request handlers.
+
+    PROFILE_SAMPLE_N=100    profile one request in 100
+    PROFILE_SLOW_MS=250     keep the profile of every request slower than 250 ms
+    PROFILE_TOKEN=s3cret    a request sent with "X-Profile: s3cret" is always profiled
+    PROFILE_DIR=profiles    where profiles go (the newest PROFILE_KEEP=200 are kept)
+    PROFILE_INTERVAL_MS=5   sampling period
+
+A profiled request's thread is sampled by one background thread reading
+sys._current_frames(), so the handler itself runs uninstrumented; with
+PROFILE_SLOW_MS every request is sampled and only slow ones are written.
+Each profile is one JSON file of collapsed stacks ("a;b;c" -> samples,
+flame-graph ready) plus request metadata; a request shorter than the
+sampling period may get no sample and is then not written. Aggregate the
+hot functions (from the app directory):
+
+    python -m transport.profiling --endpoint route_view --last 50
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+_MAX_DEPTH = 64
+_FILE_SUFFIX = ".json"
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+class Trace:
+    """Samples collected for one request: stack (tuple of code objects, outermost first) -> count."""
+    __slots__ = ("ident", "sampled", "started", "stacks", "samples")
+
+    def __init__(self, ident: int, sampled: bool):
+        self.ident = ident
+        self.sampled = sampled          # chosen up front (1 in N / header), kept whatever its latency
+        self.started = time.perf_counter()
+        self.stacks: Dict[tuple, int] = {}
+        self.samples = 0
+
+    def add(self, frame) -> None:
+        codes = []
+        while frame is not None and len(codes) < _MAX_DEPTH:
+            if frame.f_code is _STOP_CODE:
+                return   # the request is already over, finishing its own profile
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        key = tuple(codes)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+
+class SamplingProfiler:
+    """
+    Decides which requests to profile (start), samples their threads while
+    they run and writes the kept ones to out_dir (stop). Disabled (start
+    returns None at once) unless every_n, slow_ms or token is set.
+    """
+
+    def __init__(self, out_dir: str = "profiles", every_n: int = 0, slow_ms: float = 0.0, token: str = "",
+                 interval_s: float = 0.005, keep: int = 200):
+        self.out_dir = out_dir
+        self.every_n = max(0, int(every_n))
+        self.slow_ms = max(0.0, slow_ms)
+        self.token = token
+        self.interval_s = max(0.001, interval_s)
+        self.keep = max(1, int(keep))
+        self._seen = 0
+        self._active: Dict[int, Trace] = {}   # thread ident -> its trace
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SamplingProfiler":
+        return cls(
+            out_dir=os.environ.get("PROFILE_DIR", "profiles"),
+            every_n=int(_env_number("PROFILE_SAMPLE_N", 0)),
+            slow_ms=_env_number("PROFILE_SLOW_MS", 0.0),
+            token=os.environ.get("PROFILE_TOKEN", ""),
+            interval_s=_env_number("PROFILE_INTERVAL_MS", 5.0) / 1000.0,
+            keep=int(_env_number("PROFILE_KEEP", 200)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.every_n or self.slow_ms or self.token)
+
+    def authorized(self, header: Optional[str]) -> bool:
+        """Whether a request carrying this X-Profile value may force a profile or read them."""
+        return bool(self.token) and header == self.token
+
+    # ---------- Per request ----------
+    def start(self, forced: bool = False) -> Optional[Trace]:
+        """Begin sampling the calling thread if this request is chosen (or could still turn out slow)."""
+        if not self.enabled:
+            return None
+        with self._cond:
+            self._seen += 1
+            sampled = forced or bool(self.every_n and self._seen % self.every_n == 0)
+            if not sampled and not self.slow_ms:
+                return None
+            trace = Trace(threading.get_ident(), sampled)
+            self._active[trace.ident] = trace
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return trace
+
+    def stop(self, trace: Optional[Trace], **meta) -> Optional[str]:
+        """Stop sampling; write the profile if it was chosen or ran slow. Returns the file name written."""
+        if trace is None:
+            return None
+        elapsed_ms = (time.perf_counter() - trace.started) * 1000.0
+        with self._cond:
+            if self._active.get(trace.ident) is trace:
+                del self._active[trace.ident]
+        if not trace.samples or not (trace.sampled or (self.slow_ms and elapsed_ms >= self.slow_ms)):
+            return None
+        profile = dict(meta, elapsedMs=round(elapsed_ms, 3), samples=trace.samples,
+                       intervalMs=self.interval_s * 1000.0, startedAt=time.time() - elapsed_ms / 1000.0,
+                       reason="sampled" if trace.sampled else "slow",
+                       stacks={";".join(_frame_name(c) for c in stack): n for stack, n in trace.stacks.items()})
+        try:
+            return self._write(profile)
+        except OSError:
+            return None   # profiling must never fail the request
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            # sampled under the lock, so once stop() has removed a trace nothing adds to it
+            with self._cond:
+                self._cond.wait_for(lambda: self._active)
+                frames = sys._current_frames()
+                for trace in self._active.values():
+                    frame = frames.get(trace.ident)
+                    if frame is not None and trace.ident != me:
+                        trace.add(frame)
+                del frames
+            time.sleep(self.interval_s)
+
+    # ---------- Storage ----------
+    def _write(self, profile: dict) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        label = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in str(profile.get("endpoint") or "request"))
+        name = f"{time.time_ns()}-{label}{_FILE_SUFFIX}"
+        path = os.path.join(self.out_dir, name)
+        with self._write_lock:
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(profile, f)
+            os.replace(tmp, path)
+            for old in list_profiles(self.out_dir)[:-self.keep]:
+                try:
+                    os.remove(os.path.join(self.out_dir, old))
+                except OSError:
+                    pass
+        return name
+
+
+_STOP_CODE = SamplingProfiler.stop.__code__
+
+
+# ---------- Reading profiles back ----------
+def list_profiles(out_dir: str) -> List[str]:
+    """Profile file names in out_dir, oldest first."""
+    try:
+        names = [n for n in os.listdir(out_dir) if n.endswith(_FILE_SUFFIX)]
+    except OSError:
+        return []
+    return sorted(names, key=lambda n: int(n.split("-", 1)[0]) if n.split("-", 1)[0].isdigit() else 0)
+
+
+def load_profiles(out_dir: str, endpoint: Optional[str] = None, last: int = 100) -> List[dict]:
+    """The newest `last` profiles (of endpoint, if given), newest first."""
+    out = []
+    for name in reversed(list_profiles(out_dir)):
+        if len(out) >= last:
+            break
+        try:
+            with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if endpoint and profile.get("endpoint") != endpoint:
+            continue
+        profile["id"] = name
+        out.append(profile)
+    return out
+
+
+def top_functions(profiles: List[dict], limit: int = 20) -> List[dict]:
+    """
+    Hottest functions over profiles: `self` counts samples with the function
+    on top of the stack, `total` samples with it anywhere on it (recursion
+    counted once), both also as a share of all samples.
+    """
+    own: Dict[str, int] = {}
+    total: Dict[str, int] = {}
+    samples = 0
+    for profile in profiles:
+        for stack, n in (profile.get("stacks") or {}).items():
+            frames = stack.split(";")
+            samples += n
+            own[frames[-1]] = own.get(frames[-1], 0) + n
+            for name in set(frames):
+                total[name] = total.get(name, 0) + n
+    ranked = sorted(total, key=lambda name: (own.get(name, 0), total[name]), reverse=True)[:limit]
+    return [{"function": name, "self": own.get(name, 0), "total": total[name],
+             "selfPct": round(100.0 * own.get(name, 0) / samples, 1) if samples else 0.0,
+             "totalPct": round(100.0 * total[name] / samples, 1) if samples else 0.0}
+            for name in ranked]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dir", default=os.environ.get("PROFILE_DIR", "profiles"))
+    ap.add_argument("--endpoint", help="only profiles of this Flask endpoint (e.g. api_arrivals)")
+    ap.add_argument("--last", type=int, default=100, help="aggregate the newest N profiles")
+    ap.add_argument("--limit", type=int, default=25, help="functions to show")
+    ap.add_argument("--sort", choices=("self", "total"), default="self")
+    args = ap.parse_args(argv)
+
+    profiles = load_profiles(args.dir, args.endpoint, args.last)
+    if not profiles:
+        print(f"no profiles in {args.dir}")
+        return 1
+    rows = top_functions(profiles, limit=10 ** 9)
+    rows.sort(key=lambda r: (r[args.sort], r["total"]), reverse=True)
+    slowest = max(p.get("elapsedMs", 0) for p in profiles)
+    print(f"{len(profiles)} profiles, {sum(p.get('samples', 0) for p in profiles)} samples, slowest {slowest:.1f} ms")
+    print(f"{'self%':>6} {'total%':>7}  function")
+    for r in rows[:args.limit]:
+        print(f"{r['selfPct']:6.1f} {r['totalPct']:7.1f}  {r['function']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
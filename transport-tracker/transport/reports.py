@@ -0,0 +1,75 @@
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from .data_structs import Stack
+
+
+def _ts(report: dict) -> int:
+    try:
+        return int(report.get("timestampEpoch", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class RecentReports:
+    """
+    Newest `per_route` reports of each route in a bounded ring-buffer Stack.
+
+    A route's ring is filled by one ordered, limited fetch (`fetch(rid, n)`
+    returns up to n reports, any order) on first read and again once it is
+    older than `ttl` seconds, so reports written by other processes still show
+    up; our own writes are pushed in place by add(). Reads cost O(limit)
+    however long a route's incident history grows. version(rid) changes
+    whenever a route's ring content does, for cache validators.
+    """
+
+    def __init__(self, fetch: Callable[[Hashable, int], List[dict]], per_route: int = 100, ttl: float = 30.0):
+        self.per_route = per_route
+        self.ttl = ttl
+        self._fetch = fetch
+        self._rings: Dict[Hashable, Tuple[float, Stack]] = {}  # rid -> (loaded at, ring oldest..newest)
+        self._versions: Dict[Hashable, int] = {}
+
+    def recent(self, rid: Hashable, limit: int) -> List[dict]:
+        """Up to limit reports for rid, newest first."""
+        if limit <= 0:
+            return []
+        if limit > self.per_route:
+            return sorted(self._fetch(rid, limit), key=_ts, reverse=True)[:limit]
+        items = self._ring(rid).to_list()
+        items.reverse()
+        return items[:limit]
+
+    def add(self, rid: Hashable, report: dict) -> None:
+        """Record a report we just wrote (only if the route's ring is loaded)."""
+        entry = self._rings.get(rid)
+        if entry is not None:
+            entry[1].push(report)
+            self._versions[rid] = self._versions.get(rid, 0) + 1
+
+    def version(self, rid: Hashable) -> int:
+        """Changes whenever rid's newest reports do (reloading the ring first if it is stale)."""
+        self._ring(rid)
+        return self._versions.get(rid, 0)
+
+    def invalidate(self, rid: Hashable) -> None:
+        if self._rings.pop(rid, None) is not None:
+            self._versions[rid] = self._versions.get(rid, 0) + 1
+
+    def _ring(self, rid: Hashable) -> Stack:
+        entry = self._rings.get(rid)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            entry = self._load(rid, entry[1] if entry else None)
+        return entry[1]
+
+    def _load(self, rid: Hashable, old: Optional[Stack] = None) -> Tuple[float, Stack]:
+        ring = Stack(maxlen=self.per_route)
+        for report in sorted(self._fetch(rid, self.per_route), key=_ts):
+            ring.push(report)
+        if old is None or old.to_list() != ring.to_list():
+            self._versions[rid] = self._versions.get(rid, 0) + 1
+        entry = (time.monotonic(), ring)
+        self._rings[rid] = entry
+        return entry
+
+    def __len__(self) -> int:
+        return len(self._rings)
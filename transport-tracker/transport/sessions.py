@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+from .data_structs import Stack
+
+
+class RecentSearches:
+    """
+    Recent (route_id, stop_name) searches kept per session / client.
+
+    Each session gets its own bounded ring-buffer Stack; at most
+    `max_sessions` sessions are tracked and the least recently used one is
+    evicted past that, so memory stays bounded however many clients show up.
+    Every shared-state step is a single OrderedDict call (get / setdefault /
+    move_to_end / popitem), each atomic under the GIL, so requests from
+    different sessions never queue behind a common lock.
+    """
+
+    def __init__(self, per_session: int = 20, max_sessions: int = 10000):
+        self.per_session = per_session
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[Hashable, Stack]" = OrderedDict()
+
+    def _stack(self, session_id: Hashable, create: bool) -> Optional[Stack]:
+        stack = self._sessions.get(session_id)
+        if stack is None:
+            if not create:
+                return None
+            stack = self._sessions.setdefault(session_id, Stack(maxlen=self.per_session))
+        try:
+            self._sessions.move_to_end(session_id)
+        except KeyError:
+            pass  # evicted by another request in between; the caller's stack is still usable
+        while len(self._sessions) > self.max_sessions:
+            try:
+                self._sessions.popitem(last=False)
+            except KeyError:
+                break
+        return stack
+
+    def push(self, session_id: Hashable, pair: Tuple[str, str]) -> None:
+        """Push pair for this session unless it repeats the session's last entry."""
+        stack = self._stack(session_id, create=True)
+        if stack.top() != pair:
+            stack.push(pair)
+
+    def items(self, session_id: Hashable) -> List[Tuple[str, str]]:
+        """Newest first."""
+        stack = self._stack(session_id, create=False)
+        return list(reversed(stack.to_list())) if stack else []
+
+    def clear(self, session_id: Hashable) -> None:
+        self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
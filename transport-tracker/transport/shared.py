@@ -0,0 +1,212 @@
+import hashlib
+import hmac
+import mmap
+import os
+import stat
+import struct
+import tempfile
+from typing import Callable, Optional, Tuple, TypeVar
+
+try:
+    import fcntl
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # optional: without POSIX locks / shared memory every worker loads on its own
+    fcntl = None
+
+HAVE_SHARED = fcntl is not None
+
+# control block: generation (0 = nothing published yet), wall time the publisher last knew its data current
+_CONTROL = struct.Struct("<Qd")
+# data segment header: payload length, HMAC-SHA256 of (generation, payload); padded so the payload is 64-byte aligned
+_HEADER = struct.Struct("<Q32s24x")
+_GENERATION = struct.Struct("<Q")
+
+T = TypeVar("T")
+
+
+def _open(name: str, size: int = 0) -> "shared_memory.SharedMemory":
+    """
+    Create (size > 0) or attach a segment that outlives this process (not
+    unlinked by the resource tracker). Refuses one another user created or
+    could write to.
+    """
+    shm = shared_memory.SharedMemory(name, create=size > 0, size=size)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    st = os.fstat(shm._fd)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        shm.close()
+        raise PermissionError(f"shared memory segment {name} is not private to this user")
+    return shm
+
+
+def _private_dir() -> str:
+    """<tmp>/transport-shm-<uid>: created 0700, refused unless it is a directory only this user can use."""
+    path = os.path.join(tempfile.gettempdir(), f"transport-shm-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory private to this user")
+    return path
+
+
+def _deployment_key(folder: str, name: str) -> bytes:
+    """Random key in <folder>/<name>.key, created by whichever worker gets there first."""
+    path = os.path.join(folder, name + ".key")
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(dir=folder)   # 0600
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(os.urandom(32))
+            try:
+                os.link(tmp, path)   # never replaces a key another worker already uses
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(tmp)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class SharedSnapshot:
+    """
+    One snapshot shared by every worker process of a host, published through
+    POSIX shared memory under `name`.
+
+    The process holding an exclusive lock on <name>.lock in _private_dir() is
+    the publisher: it alone talks to Firebase and writes each new snapshot
+    (bytes, see persist.dumps) into a fresh segment `<name>-<generation>`,
+    then advances the generation in the small control segment `<name>`.
+    Readers only decode (unpickle) a segment this user owns whose HMAC checks
+    out under `key` (default: a random key kept next to the lock file).
+    Workers compare the generation and map a new segment read-only when it
+    moved; array data in it (see persist.dumps) is used in place, so those
+    pages exist once per host, not once per worker. A segment is never
+    written after it is published, so readers need no lock; the publisher
+    unlinks the previous one and a reader that raced it just reads the
+    generation again. If the publisher exits its lock is released and the
+    next worker to call lead() takes over.
+    """
+
+    def __init__(self, name: str, key: Optional[bytes] = None):
+        if not HAVE_SHARED:
+            raise RuntimeError("SharedSnapshot needs POSIX shared memory")
+        self.name = name
+        self._dir = _private_dir()
+        self._key = key or _deployment_key(self._dir, name)
+        self.leading = False
+        self.generation = 0      # last generation published or read here
+        self._lock_file = None
+        self._control: Optional[shared_memory.SharedMemory] = None
+        self._segment: Optional[shared_memory.SharedMemory] = None  # publisher: the current generation
+
+    # ---------- Publisher ----------
+    def lead(self) -> bool:
+        """Try to become the publisher (non-blocking); True if this process is it."""
+        if self.leading:
+            return True
+        f = open(os.path.join(self._dir, self.name + ".lock"), "a+b")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        self.generation = self.read()[0]   # continue after a previous publisher
+        self.leading = True
+        return True
+
+    def publish(self, data: bytes, fresh_at: float) -> int:
+        """Make data the current snapshot; returns its generation."""
+        generation = self.generation + 1
+        segment = _open(f"{self.name}-{generation}", _HEADER.size + max(len(data), 1))
+        _HEADER.pack_into(segment.buf, 0, len(data), self._mac(generation, data))
+        segment.buf[_HEADER.size:_HEADER.size + len(data)] = data
+        _CONTROL.pack_into(self._attach_control(create=True).buf, 0, generation, fresh_at)
+        old, self._segment, self.generation = self._segment, segment, generation
+        if old is not None:
+            old.close()
+        self._unlink(generation - 1)   # also reaps a dead publisher's last segment
+        return generation
+
+    def touch(self, fresh_at: float) -> None:
+        """Tell readers the current generation is still current as of fresh_at."""
+        if self.generation:
+            _CONTROL.pack_into(self._attach_control(create=True).buf, 0, self.generation, fresh_at)
+
+    def close(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        if self._lock_file is not None:
+            self._lock_file.close()   # releases the lock for another worker
+            self._lock_file = None
+        self.leading = False
+
+    # ---------- Readers ----------
+    def read(self) -> Tuple[int, float]:
+        """(generation, fresh_at) as last published; (0, 0.0) before the first publish."""
+        control = self._attach_control()
+        return _CONTROL.unpack_from(control.buf, 0) if control is not None else (0, 0.0)
+
+    def fetch(self, decode: Callable[[memoryview], T]) -> Optional[Tuple[int, float, T]]:
+        """
+        (generation, fresh_at, decode(data)) if a generation newer than the
+        last one fetched was published. data is a read-only mapping of the
+        segment that decode may keep views of: the pages stay mapped (and are
+        shared with every other reader) until the last view is gone, even
+        after the publisher unlinks the segment.
+        """
+        for _ in range(3):
+            generation, fresh_at = self.read()
+            if not generation or generation == self.generation:
+                return None
+            try:
+                segment = _open(f"{self.name}-{generation}")
+            except FileNotFoundError:
+                continue   # superseded and unlinked between the two reads
+            try:
+                size, mac = _HEADER.unpack_from(segment.buf, 0)
+                mapped = mmap.mmap(segment._fd, _HEADER.size + size, prot=mmap.PROT_READ)
+            finally:
+                segment.close()
+            view = memoryview(mapped)[_HEADER.size:]
+            if not hmac.compare_digest(mac, self._mac(generation, view)):
+                raise ValueError(f"segment {self.name}-{generation} failed authentication")
+            value = decode(view)
+            self.generation = generation
+            return generation, fresh_at, value
+        return None
+
+    def _mac(self, generation: int, data) -> bytes:
+        mac = hmac.new(self._key, _GENERATION.pack(generation), hashlib.sha256)
+        mac.update(data)
+        return mac.digest()
+
+    def _attach_control(self, create: bool = False):
+        if self._control is None:
+            try:
+                self._control = _open(self.name)
+            except FileNotFoundError:
+                if not create:
+                    return None
+                try:
+                    self._control = _open(self.name, _CONTROL.size)
+                except FileExistsError:
+                    self._control = _open(self.name)
+        return self._control
+
+    def _unlink(self, generation: int) -> None:
+        if generation <= 0:
+            return
+        try:
+            segment = shared_memory.SharedMemory(f"{self.name}-{generation}")   # unlink() unregisters it again
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
@@ -0,0 +1,150 @@
+import json
+import queue
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, Optional
+
+
+class RouteVersions:
+    """
+    Per-route change counters. Every bump advances one global clock and stamps
+    the route with it, so a route's version only grows and "did anything
+    change since clock c" is a single comparison; waiters block on a shared
+    condition instead of polling.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._clock = 0
+        self._versions: Dict[Hashable, int] = {}
+
+    def bump(self, rid: Hashable) -> None:
+        self.bump_many((rid,))
+
+    def bump_many(self, rids: Iterable[Hashable]) -> None:
+        with self._cond:
+            self._clock += 1
+            for rid in rids:
+                self._versions[rid] = self._clock
+            self._cond.notify_all()
+
+    def get(self, rid: Hashable) -> int:
+        return self._versions.get(rid, 0)
+
+    def as_dict(self) -> Dict[Hashable, int]:
+        with self._cond:
+            return dict(self._versions)
+
+    @property
+    def clock(self) -> int:
+        return self._clock
+
+    def notify(self) -> None:
+        """Wake waiters without recording a change."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait_for(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(predicate, timeout)
+
+
+class Subscription:
+    """One client's mailbox: holds only the latest undelivered payload."""
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.last_sent: Optional[str] = None
+        self._box: "queue.Queue[str]" = queue.Queue(maxsize=1)
+
+    def offer(self, payload: str) -> None:
+        while True:
+            try:
+                self._box.put_nowait(payload)
+                return
+            except queue.Full:
+                try:
+                    self._box.get_nowait()   # a slow reader only needs the newest state
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float) -> Optional[str]:
+        try:
+            return self._box.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class RouteStreamHub:
+    """
+    Fans route updates out from one shared producer thread to every
+    subscriber (keys are tuples whose first item is the route id). The
+    producer wakes when a route version changes, and every `tick` seconds
+    since ETAs roll over with the clock; it renders each subscribed key once
+    and hands the payload only to subscribers whose last delivery differs, so
+    idle routes cost nothing per open tab.
+    """
+
+    def __init__(self, versions: RouteVersions, render: Callable[[Hashable], dict], tick: float = 30.0):
+        self.versions = versions
+        self.tick = tick
+        self._render = render
+        self._subs: Dict[Hashable, set] = {}       # key -> {Subscription}
+        self._lock = threading.Lock()
+        self._fresh = False                        # a subscriber is waiting for its first payload
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, key: Hashable) -> Subscription:
+        sub = Subscription(key)
+        with self._lock:
+            self._subs.setdefault(key, set()).add(sub)
+            self._fresh = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="route-stream", daemon=True)
+                self._thread.start()
+        self.versions.notify()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.key)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.key]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subs.values())
+
+    def _run(self) -> None:
+        rendered: Dict[Hashable, int] = {}   # key -> route version of its last render
+        seen_clock = -1
+        next_tick = time.monotonic() + self.tick
+        while True:
+            self.versions.wait_for(lambda: self.versions.clock != seen_clock or self._fresh,
+                                   max(0.0, next_tick - time.monotonic()))
+            seen_clock = self.versions.clock
+            ticked = time.monotonic() >= next_tick
+            if ticked:
+                next_tick = time.monotonic() + self.tick
+            with self._lock:
+                self._fresh = False
+                work = [(key, list(subs)) for key, subs in self._subs.items()]
+            for key in list(rendered):
+                if key not in self._subs:
+                    del rendered[key]
+            for key, subs in work:
+                version = self.versions.get(key[0])
+                new_sub = any(s.last_sent is None for s in subs)
+                if not (ticked or new_sub or rendered.get(key) != version):
+                    continue
+                rendered[key] = version
+                try:
+                    payload = json.dumps(self._render(key), sort_keys=True)
+                except Exception:
+                    continue
+                for sub in subs:
+                    if sub.last_sent != payload:
+                        sub.last_sent = payload
+                        sub.offer(payload)